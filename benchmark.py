@@ -0,0 +1,519 @@
+#!/usr/bin/env python3
+"""
+Performance benchmarks for the parking lot simulation (no GUI required)
+
+Compares the PathFinder searches over the compiled RoadGraph and the cached
+ExitField against the original path-copying, string-comparing Dijkstra on
+the standard 31x31 lot and on larger grids.
+"""
+
+import gc
+import heapq
+import os
+import random
+import statistics
+import sys
+import time
+
+import parking_lot_simulation as sim
+from parking_lot_simulation import ParkingLot, LotLayout, Car, CarPool, SimulationEngine
+
+
+def legacy_neighbors(lot, pos, cell_type='road'):
+    """Original neighbour scan: string compare on every grid lookup"""
+    rows, cols = len(lot.grid), len(lot.grid[0])
+    row, col = pos
+    cells = []
+    for dr, dc in [(0, 1), (1, 0), (0, -1), (-1, 0)]:
+        new_row, new_col = row + dr, col + dc
+        if 0 <= new_row < rows and 0 <= new_col < cols:
+            if lot.grid[new_row][new_col] == cell_type:
+                cells.append((new_row, new_col))
+    return cells
+
+
+def legacy_path_to_parking(lot, start_pos, weights):
+    """Original search: pushes a copy of the whole path on every relaxation.
+    
+    weights is a list-of-lists copy of lot.road_weights, as the original
+    implementation stored them.
+    """
+    pq = [(0, start_pos, [start_pos])]
+    visited = {start_pos: 0}
+    while pq:
+        cost, pos, path = heapq.heappop(pq)
+        for parking_pos in legacy_neighbors(lot, pos, 'parking'):
+            if lot.parking_status.get(parking_pos) == 'empty':
+                return path, parking_pos, cost
+        for neighbor in legacy_neighbors(lot, pos):
+            new_cost = cost + weights[neighbor[0]][neighbor[1]]
+            if neighbor not in visited or new_cost < visited[neighbor]:
+                visited[neighbor] = new_cost
+                heapq.heappush(pq, (new_cost, neighbor, path + [neighbor]))
+    return None, None, float('inf')
+
+
+def legacy_path_to_exit(lot, start_pos, weights):
+    """Original exit search, same path-copying scheme"""
+    pq = [(0, start_pos, [start_pos])]
+    visited = {start_pos: 0}
+    while pq:
+        cost, pos, path = heapq.heappop(pq)
+        if pos in lot.layout.exit_points:
+            return path, pos, cost
+        for neighbor in legacy_neighbors(lot, pos):
+            new_cost = cost + weights[neighbor[0]][neighbor[1]]
+            if neighbor not in visited or new_cost < visited[neighbor]:
+                visited[neighbor] = new_cost
+                heapq.heappush(pq, (new_cost, neighbor, path + [neighbor]))
+    return None, None, float('inf')
+
+
+def make_lot(layout=None, fill=0.9, seed=1):
+    """Build a nearly full lot with uneven road weights.
+    
+    Free stalls only remain in the quarter of the lot farthest from the
+    entries (and only a 1 - fill share of those), the peak-hour worst case.
+    """
+    lot = ParkingLot(layout)
+    rng = random.Random(seed)
+    far_rows = len(lot.grid) * 3 // 4
+    for pos in list(lot.parking_status):
+        if pos[0] < far_rows or rng.random() < fill:
+            lot.occupy_parking(pos)
+    for row, cells in enumerate(lot.grid):
+        for col, cell in enumerate(cells):
+            if cell == 'road':
+                lot.road_weights[row, col] = 1.0 + rng.random() * 3
+    lot.exit_field.invalidate()
+    return lot
+
+
+def median_time(func, repeat):
+    """Median wall time of `repeat` calls, in milliseconds"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000
+
+
+def same_route(legacy_result, new_result):
+    """Routes agree on cost and destination (ties may pick another path)"""
+    (_, legacy_dest, legacy_cost), (_, new_dest, new_cost) = legacy_result, new_result
+    return legacy_dest == new_dest and abs(legacy_cost - new_cost) < 1e-9
+
+
+def bench_pathfinding(grid_sizes=(31, 101, 201, 301), repeat=5):
+    """Time parking and exit searches, legacy vs current, per grid size.
+    
+    'exit' is a lookup in an up-to-date ExitField; 'exit+churn' first
+    changes the weight of a few cells along a route, as moving cars do,
+    so the field has to repair itself before answering.
+    """
+    print(f"{'grid':>6} {'search':>10} {'legacy ms':>10} {'new ms':>8} {'speedup':>8}")
+    for size in grid_sizes:
+        lot = make_lot(LotLayout(size))
+        weights = lot.road_weights.tolist()
+        far_corner = (0, size - 1)  # Opposite corner from the exits
+        churn_cells = lot.find_shortest_path_to_exit(far_corner)[0][::max(1, size // 8)]
+        loaded = {'legacy': False, 'new': False}
+        
+        def churn(arm):
+            # Alternately load and unload the cells so every call changes weights
+            loaded[arm] = not loaded[arm]
+            for row, col in churn_cells:
+                if arm == 'new' and loaded[arm]:
+                    lot.increment_segment((row, col), 10.5)
+                elif arm == 'new':
+                    lot.decrement_segment((row, col), 10.5)
+                elif loaded[arm]:
+                    weights[row][col] += 10.5
+                else:
+                    weights[row][col] = max(1.0, weights[row][col] - 10.5)
+        
+        cases = [
+            ('parking', lambda: [legacy_path_to_parking(lot, e, weights) for e in lot.layout.entry_points],
+                        lambda: [lot.find_shortest_path_to_parking(e) for e in lot.layout.entry_points]),
+            ('exit', lambda: legacy_path_to_exit(lot, far_corner, weights),
+                     lambda: lot.find_shortest_path_to_exit(far_corner)),
+            ('exit+churn', lambda: (churn('legacy'), legacy_path_to_exit(lot, far_corner, weights))[1],
+                           lambda: (churn('new'), lot.find_shortest_path_to_exit(far_corner))[1]),
+        ]
+        assert [legacy_path_to_parking(lot, e, weights) for e in lot.layout.entry_points] == \
+            [lot.find_shortest_path_to_parking(e) for e in lot.layout.entry_points], \
+            f"parking search results differ at {size}x{size}"
+        churn('legacy')
+        churn('new')
+        assert same_route(legacy_path_to_exit(lot, far_corner, weights),
+                          lot.find_shortest_path_to_exit(far_corner)), \
+            f"exit search results differ at {size}x{size}"
+        for name, legacy, new in cases:
+            legacy_ms = median_time(legacy, repeat)
+            new_ms = median_time(new, repeat)
+            print(f"{size:>6} {name:>10} {legacy_ms:>10.2f} {new_ms:>8.2f} {legacy_ms / new_ms:>7.1f}x")
+
+
+def legacy_update_path_weights(lot, weights, path, increment=1.5):
+    """Original per-cell weight update with a string compare per cell"""
+    for pos in path:
+        if lot.grid[pos[0]][pos[1]] == 'road':
+            weights[pos[0]][pos[1]] += increment
+
+
+def legacy_release_path_weights(lot, weights, path, decrement=1.5):
+    """Original per-cell weight release with the clamp to 1.0"""
+    for pos in path:
+        if lot.grid[pos[0]][pos[1]] == 'road':
+            weights[pos[0]][pos[1]] -= decrement
+            weights[pos[0]][pos[1]] = max(1.0, weights[pos[0]][pos[1]])
+
+
+def bench_weights(grid_sizes=(31, 101, 301), repeat=200):
+    """Reserve and release a long route, per-cell loop vs array update"""
+    print(f"{'grid':>6} {'path':>5} {'legacy us':>10} {'new us':>8} {'snapshot us':>12}")
+    for size in grid_sizes:
+        lot = make_lot(LotLayout(size))
+        weights = lot.road_weights.tolist()
+        path = lot.find_shortest_path_to_exit((0, size - 1))[0]
+        
+        def legacy():
+            legacy_update_path_weights(lot, weights, path)
+            legacy_release_path_weights(lot, weights, path)
+        
+        def new():
+            lot.update_path_weights(path)
+            lot.release_path_weights(path)
+        
+        legacy_us = median_time(legacy, repeat) * 1000
+        new_us = median_time(new, repeat) * 1000
+        snapshot_us = median_time(lot.road_weights.copy, repeat) * 1000
+        print(f"{size:>6} {len(path):>5} {legacy_us:>10.1f} {new_us:>8.1f} {snapshot_us:>12.1f}")
+
+
+def bench_astar(grid_sizes=(31, 101, 201), fills=(0.5, 0.9, 0.99), searches=50, repeat=3):
+    """Nodes expanded and time per parking search, Dijkstra vs A*, from random roads"""
+    print(f"{'grid':>6} {'fill':>5} {'dijkstra nodes':>15} {'astar nodes':>12} "
+          f"{'dijkstra ms':>12} {'astar ms':>9}")
+    for size in grid_sizes:
+        for fill in fills:
+            lot = make_lot(LotLayout(size), fill=fill)
+            rng = random.Random(size)
+            roads = [(r, c) for r in range(size) for c in range(size) if lot.grid[r][c] == 'road']
+            starts = [rng.choice(roads) for _ in range(searches)]
+            row = [size, fill]
+            for mode in ('dijkstra', 'astar'):
+                expanded = lot.pathfinder.total_expanded
+                for start in starts:
+                    lot.find_shortest_path_to_parking(start, search=mode)
+                row.append((lot.pathfinder.total_expanded - expanded) / searches)
+            for mode in ('dijkstra', 'astar'):
+                run = lambda: [lot.find_shortest_path_to_parking(s, search=mode) for s in starts]
+                row.append(median_time(run, repeat) / searches)
+            print("{:>6} {:>5} {:>15.0f} {:>12.0f} {:>12.3f} {:>9.3f}".format(*row))
+
+
+def bench_route_cache(tolerances=(None, 0.0, 0.05, 0.1, 0.25), size=61, ticks=10000, seeds=(4, 5, 6)):
+    """Seeded runs with the route cache off and at several tolerances.
+    
+    Tolerance 0 must reproduce the uncached runs exactly. Every tenth hit
+    is audited against a fresh search: 'excess' is how much dearer served
+    routes were than the best route, 'worse' how many of them were not
+    the best. Time, hit rate and throughput are averaged over the seeds,
+    since single runs vary a lot.
+    """
+    print(f"{'tolerance':>9} {'ms/tick':>8} {'hit rate':>9} {'excess':>7} {'worse':>6} {'out/60t':>8} "
+          f"{'same runs':>10}")
+    references = {}
+    for tolerance in tolerances:
+        rows = []
+        for seed in seeds:
+            engine = SimulationEngine(60, LotLayout(size), seed=seed)
+            if tolerance is not None:
+                cache = engine.parking_lot.enable_route_cache(tolerance=tolerance, audit_every=10)
+            start = time.perf_counter()
+            engine.step(ticks)
+            ms = (time.perf_counter() - start) * 1000 / ticks
+            digest = engine.digest()
+            same = references.setdefault(seed, digest) == digest
+            stats = (cache.stats() if tolerance is not None
+                     else {'hit_rate': 0.0, 'mean_excess_cost': 0.0, 'worse_rate': 0.0})
+            rows.append((ms, stats['hit_rate'], stats['mean_excess_cost'], stats['worse_rate'],
+                         engine.metrics()['exits_per_60_ticks'], same))
+        ms, hit_rate, excess, worse, throughput = (statistics.mean(row[i] for row in rows) for i in range(5))
+        label = 'off' if tolerance is None else f"{tolerance:.2f}"
+        print(f"{label:>9} {ms:>8.3f} {hit_rate:>9.1%} {excess:>7.1%} {worse:>6.0%} {throughput:>8.2f} "
+              f"{str(all(row[5] for row in rows)):>10}")
+
+
+def bench_movement(fleet_sizes=(100, 1000, 5000), size=301, ticks=60):
+    """Ticks per second moving a fleet of cars: per-car update vs CarStore kernel.
+    
+    Every car drives from its own random road cell towards the exits, so most
+    ticks are pure movement and one in ten crosses a cell boundary.
+    """
+    print(f"{'cars':>6} {'per-car ms/tick':>16} {'store ms/tick':>14} {'speedup':>8}")
+    for n_cars in fleet_sizes:
+        rng = random.Random(n_cars)
+        arms = []
+        for batched in (False, True):
+            engine = SimulationEngine(0, LotLayout(size))
+            lot = engine.parking_lot
+            roads = [(r, c) for r in range(size) for c in range(size) if lot.grid[r][c] == 'road']
+            for car_id, start in enumerate(rng.sample(roads, n_cars)):
+                path, exit_point, _ = lot.find_shortest_path_to_exit(start)
+                car = Car(car_id, start, path, exit_point, lot, is_exiting=True,
+                          store=engine.store if batched else None, parking_duration=600)
+                engine.add_car(car)
+            rng = random.Random(n_cars)
+            if batched:
+                run = engine.update_cars
+            else:
+                run = lambda cars=engine.cars: [car.update() for car in cars]
+            arms.append(median_time(run, ticks))
+        print(f"{n_cars:>6} {arms[0]:>16.2f} {arms[1]:>14.2f} {arms[0] / arms[1]:>7.1f}x")
+
+
+class DictCar:
+    """Stand-in for the original Car, which kept its attributes in a __dict__"""
+
+
+def car_bytes(car):
+    """Shallow size of a car object, including its instance dict if it has one"""
+    size = sys.getsizeof(car)
+    if hasattr(car, '__dict__'):
+        size += sys.getsizeof(car.__dict__)
+    return size
+
+
+def soak(pooled, ticks=10000, seed=5):
+    """Run a busy lot and count car allocations and gen-0 collections"""
+    random.seed(seed)
+    engine = SimulationEngine(120)
+    if not pooled:
+        engine.pool = CarPool(max_size=0)
+    gc.collect()
+    collections = gc.get_stats()[0]['collections']
+    start = time.perf_counter()
+    engine.step(ticks)
+    elapsed = time.perf_counter() - start
+    return (engine.car_counter, engine.pool.created,
+            gc.get_stats()[0]['collections'] - collections, elapsed)
+
+
+def bench_memory():
+    """Bytes per car (dict vs __slots__) and allocation churn over a soak run"""
+    lot = ParkingLot()
+    entry = lot.layout.entry_points[0]
+    car = Car(0, entry, lot.find_shortest_path_to_parking(entry)[0], (1, 1), lot, parking_duration=600)
+    legacy = DictCar()
+    legacy.__dict__.update({name: getattr(car, name) for name in Car.__slots__})
+    print(f"bytes per car object: dict {car_bytes(legacy)}, slotted {car_bytes(car)}")
+    print(f"{'pool':>6} {'spawned':>8} {'allocated':>10} {'gen0 GCs':>9} {'seconds':>8}")
+    for pooled in (False, True):
+        spawned, allocated, collections, elapsed = soak(pooled)
+        print(f"{'on' if pooled else 'off':>6} {spawned:>8} {allocated:>10} {collections:>9} {elapsed:>8.2f}")
+
+
+def legacy_detect_deadlock(engine):
+    """Original check: rebuild the dependency dict (a linear car scan per
+    waiting car), then DFS from each waiting car until the first cycle"""
+    waiting_cars = [car for car in engine.cars if car.state == 'waiting']
+    dependencies = {}
+    for car in waiting_cars:
+        if car.target_segment:
+            blocking_car_id = engine.parking_lot.road_occupancy.get(car.target_segment)
+            if blocking_car_id is not None:
+                blocking_car = next((c for c in engine.cars if c.id == blocking_car_id), None)
+                if blocking_car and blocking_car.state == 'waiting':
+                    dependencies[car.id] = blocking_car.id
+    visited = set()
+    for car in waiting_cars:
+        car_id, rec_stack = car.id, set()
+        while car_id is not None and car_id not in visited:
+            visited.add(car_id)
+            rec_stack.add(car_id)
+            car_id = dependencies.get(car_id)
+        if car_id in rec_stack:
+            return [c for c in waiting_cars if c.id in visited]
+    return []
+
+
+def waiting_queue(n_cars, size=301):
+    """An engine whose cars all wait in one long queue (no cycle)"""
+    engine = SimulationEngine(0, LotLayout(size))
+    lot = engine.parking_lot
+    roads = [(r, c) for r in range(size) for c in range(size) if lot.grid[r][c] == 'road']
+    for car_id in range(n_cars):
+        car = Car(car_id, roads[car_id], [roads[car_id], roads[car_id + 1]], roads[car_id + 1], lot,
+                  wait_graph=engine.wait_graph, parking_duration=600)
+        engine.add_car(car)
+        car.state = 'waiting'
+    return engine
+
+
+def bench_deadlock_check(fleet_sizes=(100, 1000, 3000), repeat=5):
+    """Cost of one deadlock check over a queue of waiting cars.
+    
+    The original rebuilds the whole dependency graph every check; the
+    wait-for graph only walks from cars that started waiting, here the car
+    at the back of the queue (the worst case, a walk down the whole queue).
+    """
+    print(f"{'cars':>6} {'full rebuild ms':>16} {'incremental ms':>15}")
+    for n_cars in fleet_sizes:
+        engine = waiting_queue(n_cars)
+        assert legacy_detect_deadlock(engine) == [] and engine.detect_deadlock() == [], \
+            "A queue is not a deadlock"
+        back = engine.cars_by_id[0]
+        
+        def incremental():
+            back.state = 'entering'
+            back.state = 'waiting'
+            return engine.detect_deadlock()
+        
+        legacy_ms = median_time(lambda: legacy_detect_deadlock(engine), repeat)
+        new_ms = median_time(incremental, repeat)
+        print(f"{n_cars:>6} {legacy_ms:>16.2f} {new_ms:>15.3f}")
+
+
+def parked_fleet(n_cars, batched, size=301):
+    """An engine with n_cars parked for good, all registered with the engine"""
+    engine = SimulationEngine(0, LotLayout(size))
+    lot = engine.parking_lot
+    for car_id, stall in enumerate(list(lot.parking_status)[:n_cars]):
+        road = lot.get_neighbors(stall)[0]
+        car = Car(car_id, road, [road], stall, lot, store=engine.store if batched else None,
+                  parking_duration=10 ** 9)
+        car.reach_destination()
+        lot.free_road(road)
+        engine.add_car(car)
+        if batched:
+            engine.scheduler.schedule(car.parking_duration, car_id)
+    return engine
+
+
+def bench_idle(fleet_sizes=(1000, 5000, 20000), size=301, ticks=30):
+    """Per-tick cost of a lot full of parked cars: polling every car vs event queue"""
+    print(f"{'parked':>7} {'polling ms/tick':>16} {'scheduled ms/tick':>18}")
+    for n_cars in fleet_sizes:
+        polling = parked_fleet(n_cars, batched=False, size=size)
+        scheduled = parked_fleet(n_cars, batched=True, size=size)
+        poll_ms = median_time(lambda: [car.update() for car in polling.cars], ticks)
+        scheduled_ms = median_time(scheduled.update_cars, ticks)
+        print(f"{n_cars:>7} {poll_ms:>16.2f} {scheduled_ms:>18.3f}")
+
+
+def legacy_draw(simulation):
+    """Original frame: every cell, grid line and weight label, then a full flip"""
+    import pygame
+    from parking_lot_simulation import (BLACK, ROAD_COLOR, TEXT_COLOR, EMPTY_PARKING_COLOR,
+                                        RESERVED_PARKING_COLOR, OCCUPIED_PARKING_COLOR, CELL_SIZE)
+    screen = simulation.screen
+    lot = simulation.parking_lot
+    screen.fill(BLACK)
+    for row in range(len(lot.grid)):
+        for col in range(len(lot.grid)):
+            x = col * CELL_SIZE
+            y = row * CELL_SIZE
+            if lot.grid[row][col] == 'road':
+                pygame.draw.rect(screen, ROAD_COLOR, (x, y, CELL_SIZE, CELL_SIZE))
+                text = simulation.small_font.render(f"{lot.road_weights[row][col]:.1f}", True, TEXT_COLOR)
+                screen.blit(text, text.get_rect(center=(x + CELL_SIZE // 2, y + CELL_SIZE // 2)))
+            elif lot.grid[row][col] == 'parking':
+                status = lot.parking_status.get((row, col), 'empty')
+                color = {'empty': EMPTY_PARKING_COLOR, 'reserved': RESERVED_PARKING_COLOR}.get(
+                    status, OCCUPIED_PARKING_COLOR)
+                pygame.draw.rect(screen, color, (x, y, CELL_SIZE, CELL_SIZE))
+            pygame.draw.rect(screen, BLACK, (x, y, CELL_SIZE, CELL_SIZE), 1)
+    for car in simulation.cars:
+        if car.state in ['entering', 'exiting', 'waiting']:
+            pygame.draw.circle(screen, sim.CAR_COLOR, (int(car.visual_position[0]), int(car.visual_position[1])),
+                               CELL_SIZE // 3)
+    pygame.display.flip()
+
+
+def bench_render(frames=300, warmup=600):
+    """Frame time of the original full redraw vs cached, dirty-rect drawing.
+    
+    Uses SDL's dummy video driver, so this measures drawing, not the
+    display; on a real display the smaller updates save more.
+    """
+    if sim.pygame is None:
+        print("skipped (pygame is not installed)")
+        return
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    random.seed(1)
+    simulation = sim.Simulation(40)
+    for _ in range(warmup):
+        simulation.tick()
+        simulation.draw()
+    arms = {}
+    for name, draw in (('full redraw', lambda: legacy_draw(simulation)), ('dirty rects', simulation.draw)):
+        def frame():
+            simulation.tick()
+            draw()
+        arms[name] = median_time(frame, frames)
+        simulation.full_redraw = True  # The legacy arm painted over the screen
+    print(f"{'full redraw ms/frame':>21} {'dirty rects ms/frame':>21}")
+    print(f"{arms['full redraw']:>21.2f} {arms['dirty rects']:>21.2f}")
+    sim.pygame.quit()
+
+
+def bench_labels(repeat=50):
+    """Rendering every road label of a busy lot: font.render per label vs GlyphCache"""
+    if sim.pygame is None:
+        print("skipped (pygame is not installed)")
+        return
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    random.seed(1)
+    simulation = sim.Simulation(40)
+    simulation.step(1200)
+    lot = simulation.parking_lot
+    texts = [f"{lot.road_weights[row][col]:.1f}" for row, col in zip(*(lot.cells == sim.CELL_ROAD).nonzero())]
+    font = simulation.small_font
+    cache = simulation.label_cache
+    render_ms = median_time(lambda: [font.render(text, True, sim.TEXT_COLOR) for text in texts], repeat)
+    cached_ms = median_time(lambda: [cache.get(text) for text in texts], repeat)
+    print(f"{'labels':>7} {'distinct':>9} {'render ms':>10} {'cached ms':>10} {'hit rate':>9}")
+    print(f"{len(texts):>7} {len(set(texts)):>9} {render_ms:>10.2f} {cached_ms:>10.3f} "
+          f"{cache.stats()['hit_rate']:>9.3f}")
+    sim.pygame.quit()
+
+
+def main():
+    print("=" * 50)
+    print("PATHFINDING BENCHMARK")
+    print("=" * 50)
+    bench_pathfinding()
+    print()
+    print("ROUTE WEIGHT UPDATES")
+    bench_weights()
+    print()
+    print("PARKING SEARCH: DIJKSTRA VS A*")
+    bench_astar()
+    print()
+    print("ROUTE CACHE")
+    bench_route_cache()
+    print()
+    print("CAR MOVEMENT")
+    bench_movement()
+    print()
+    print("CAR MEMORY AND ALLOCATION")
+    bench_memory()
+    print()
+    print("DEADLOCK CHECK")
+    bench_deadlock_check()
+    print()
+    print("IDLE (PARKED) CARS")
+    bench_idle()
+    print()
+    print("RENDERING")
+    bench_render()
+    print()
+    print("WEIGHT LABELS")
+    bench_labels()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite with machine-readable results (no GUI required)
+
+Times the simulation hot paths - parking and exit searches, spawn_car, a
+full tick and detect_deadlock - across grid sizes, fill levels and car
+counts, writes the results as JSON and compares them against a stored
+baseline to flag regressions.
+
+    python3 benchmark_suite.py                               # run and write benchmark_results.json
+    python3 benchmark_suite.py --baseline benchmark_baseline.json
+    python3 benchmark_suite.py --save-baseline               # refresh the stored baseline
+"""
+
+import argparse
+import gc
+import io
+import json
+import platform
+import random
+import statistics
+import sys
+import time
+
+import numpy as np
+
+import parking_lot_simulation as sim
+from parking_lot_simulation import LotLayout, SimulationEngine
+from benchmark import make_lot, waiting_queue
+
+BASELINE_FILE = 'benchmark_baseline.json'
+RESULTS_FILE = 'benchmark_results.json'
+# Batches are timed in CPU time, so time the process spends preempted by
+# others does not count; the clock is coarse on some platforms (Windows)
+clock = time.process_time
+# Shortest timed batch: shorter ones are mostly timer and scheduler noise
+MIN_BATCH_MS = max(10, 50 * time.get_clock_info('process_time').resolution * 1000)
+REFERENCE_MS = MIN_BATCH_MS / 5  # Shortest reference measurement
+
+
+def reference():
+    """Seconds per pass of a fixed pure-Python loop, to gauge the machine's speed right now"""
+    passes = 0
+    start = clock()
+    while True:
+        table = {}
+        total = 0
+        for i in range(1000):
+            table[i & 255] = total
+            total += i * i % 7
+        passes += 1
+        elapsed = clock() - start
+        if elapsed * 1000 >= REFERENCE_MS:
+            return elapsed / passes
+
+
+def timed(setup, run, n):
+    """Seconds run(state, n) takes on a fresh state from setup() (set up untimed),
+    and seconds the reference workload took just before it"""
+    state = setup()
+    ref = reference()
+    start = clock()
+    run(state, n)
+    return clock() - start, ref
+
+
+def calibrate(setup, run):
+    """Iterations per batch so that one batch takes at least MIN_BATCH_MS"""
+    n = 1
+    while timed(setup, run, n)[0] * 1000 < MIN_BATCH_MS:
+        n *= 2
+    return n
+
+
+def batch_times(setup, run, repeat, n=None):
+    """ms per iteration in each of `repeat` batches of n iterations, with the collector off.
+    
+    Every batch starts from a fresh setup() state, so each one times the
+    same workload. n defaults to calibrate(); pass the baseline's count to
+    time exactly the workload it timed. Returns (ms per batch, reference
+    ms per batch, n).
+    """
+    if n is None:
+        n = calibrate(setup, run)
+    gc.collect()
+    gc.disable()
+    try:
+        times = [timed(setup, run, n) for _ in range(repeat)]
+    finally:
+        gc.enable()
+    return [seconds * 1000 / n for seconds, _ in times], [ref * 1000 for _, ref in times], n
+
+
+def snapshot(engine):
+    """A setup() that restores engine's current state from an in-memory checkpoint"""
+    buffer = io.BytesIO()
+    engine.save_checkpoint(buffer)
+    data = buffer.getvalue()
+    return lambda: SimulationEngine.load_checkpoint(io.BytesIO(data))
+
+
+def fill_stalls(lot, fill, rng):
+    """Occupy a random share of the lot's stalls"""
+    for pos in list(lot.parking_status):
+        if rng.random() < fill:
+            lot.occupy_parking(pos)
+
+
+def populate(engine, n_cars, rng):
+    """Add n_cars heading for parking from random road cells, as spawn_car would"""
+    lot = engine.parking_lot
+    roads = [(row, col) for row, cells in enumerate(lot.grid) for col, cell in enumerate(cells)
+             if cell == 'road' and not lot.is_road_occupied((row, col))]
+    for start in rng.sample(roads, n_cars):
+        path, spot, _ = lot.find_shortest_path_to_parking(start)
+        if not path:
+            break
+        lot.reserve_parking(spot)
+        lot.update_path_weights(path, 1.5)
+        engine.add_car(engine.pool.acquire(engine.car_counter, start, path, spot, lot, store=engine.store,
+                                           wait_graph=engine.wait_graph, counters=engine.counters,
+                                           parking_duration=engine.rng.randint(300, 900)))
+        engine.car_counter += 1
+
+
+def bench_parking_search(size, fill, repeat, n=None):
+    """ms per parking search (searches never change the lot, so one lot serves every batch)"""
+    lot = make_lot(LotLayout(size), fill=fill)
+    entries = lot.layout.entry_points
+    
+    def run(lot, n):
+        for i in range(n):
+            lot.find_shortest_path_to_parking(entries[i % len(entries)])
+    
+    return batch_times(lambda: lot, run, repeat, n)
+
+
+def bench_exit_search(size, fill, repeat, n=None):
+    """ms per exit search from the far corner, each after a route's weights changed.
+    
+    An iteration loads the route, searches, releases it and searches again,
+    so the lot is back where it started and every batch does the same work.
+    """
+    lot = make_lot(LotLayout(size), fill=fill)
+    far_corner = (0, size - 1)
+    path = lot.find_shortest_path_to_exit(far_corner)[0]
+    
+    def run(lot, n):
+        for _ in range(n):
+            lot.update_path_weights(path, 1.5)
+            lot.find_shortest_path_to_exit(far_corner)
+            lot.release_path_weights(path, 1.5)
+            lot.find_shortest_path_to_exit(far_corner)
+    
+    times, refs, n = batch_times(lambda: lot, run, repeat, n)
+    return [ms / 2 for ms in times], refs, n
+
+
+def bench_spawn(size, fill, repeat, n=None):
+    """ms per spawn_car, n spawns from the same restored engine per batch.
+    
+    Entries are cleared before each call so every call spawns.
+    """
+    engine = SimulationEngine(0, LotLayout(size), seed=size)
+    fill_stalls(engine.parking_lot, fill, random.Random(size))
+    engine.parking_lot.find_shortest_path_to_exit((0, 0))  # Build the exit field before the snapshot
+    
+    def run(engine, n):
+        lot = engine.parking_lot
+        for _ in range(n):
+            for entry in engine.layout.entry_points:
+                lot.free_road(entry)
+            engine.spawn_car()
+    
+    return batch_times(snapshot(engine), run, repeat, n)
+
+
+def bench_tick(size, n_cars, repeat, n=None):
+    """ms per full engine tick with n_cars on a half-full lot, n ticks from the same restored engine per batch"""
+    engine = SimulationEngine(60, LotLayout(size), seed=size + n_cars)
+    rng = random.Random(size + n_cars)
+    fill_stalls(engine.parking_lot, 0.5, rng)
+    populate(engine, n_cars, rng)
+    engine.parking_lot.find_shortest_path_to_exit((0, 0))  # Build the exit field before the snapshot
+    engine.step(5)
+    return batch_times(snapshot(engine), lambda engine, n: engine.step(n), repeat, n)
+
+
+def bench_deadlock(size, n_cars, repeat, n=None):
+    """ms per detect_deadlock after the last car of an n_cars queue starts waiting"""
+    engine = waiting_queue(n_cars, size)
+    engine.detect_deadlock()
+    back = engine.cars_by_id[0]
+    
+    def run(engine, n):
+        for _ in range(n):
+            back.state = 'entering'
+            back.state = 'waiting'
+            engine.detect_deadlock()
+    
+    return batch_times(lambda: engine, run, repeat, n)
+
+
+def run_suite(grid_sizes=(31, 101, 201), fills=(0.5, 0.9), car_counts=(100, 1000), repeat=11, iterations=None):
+    """Run every case and return {case name: {'params': ..., 'ms': ..., ...}}
+    
+    ms is the median batch (ms per iteration), batches_ms every batch in
+    the order timed and reference_ms the reference workload timed before
+    each. iterations maps case names to batch sizes to reuse (e.g. a
+    baseline's); other cases are calibrated.
+    """
+    iterations = iterations or {}
+    results = {}
+    
+    def record(name, func, **params):
+        label = name + ''.join(f"/{key}={value}" for key, value in params.items())
+        times, refs, n = func(*params.values(), repeat, iterations.get(label))
+        ms = statistics.median(times)
+        results[label] = {'params': dict(params, case=name), 'ms': ms, 'batches_ms': times,
+                          'reference_ms': refs, 'iterations': n}
+        print(f"{label:<45} {ms:>10.3f} ms  (x{n})")
+    
+    for size in grid_sizes:
+        for fill in fills:
+            record('parking_search', bench_parking_search, grid=size, fill=fill)
+            record('exit_search', bench_exit_search, grid=size, fill=fill)
+            record('spawn_car', bench_spawn, grid=size, fill=fill)
+        road_cells = int((make_lot(LotLayout(size)).cells == sim.CELL_ROAD).sum())
+        for n_cars in car_counts:
+            if n_cars * 4 > road_cells:
+                continue  # Not enough road for this many cars to move
+            record('tick', bench_tick, grid=size, cars=n_cars)
+            record('detect_deadlock', bench_deadlock, grid=size, cars=n_cars)
+    return results
+
+
+def relative_times(result):
+    """Each batch's ms per iteration over the reference ms timed just before it"""
+    return [ms / ref for ms, ref in zip(result['batches_ms'], result['reference_ms'])]
+
+
+def compare(results, baseline, tolerance):
+    """Cases slower than the baseline beyond its noise, as (name, baseline ms, ms, ratio).
+    
+    Batches are compared relative to the reference workload timed next to
+    them, which cancels out the machine running faster or slower from one
+    moment to the next. A case regressed when its median relative time is
+    more than tolerance above the baseline's and also above the baseline's
+    slowest batch, so a case whose batches spread widely needs a larger
+    slowdown to count. ratio is the ratio of the median relative times.
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get('results', {}).get(name)
+        if base is None or 'reference_ms' not in base:
+            continue  # Missing, or from a baseline without reference timings (re-record it)
+        base_times = relative_times(base)
+        base_median = statistics.median(base_times)
+        ratio = statistics.median(relative_times(result)) / base_median
+        if ratio > 1 + tolerance and ratio * base_median > max(base_times):
+            regressions.append((name, base['ms'], result['ms'], ratio))
+    return regressions
+
+
+def environment():
+    """Where the numbers came from"""
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'platform': platform.platform(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--json', default=RESULTS_FILE, help=f"where to write results (default {RESULTS_FILE})")
+    parser.add_argument('--baseline', help="baseline JSON to compare against")
+    parser.add_argument('--save-baseline', action='store_true', help=f"also write the results to {BASELINE_FILE}")
+    parser.add_argument('--tolerance', type=float, default=0.5,
+                        help="allowed slowdown before a case counts as a regression (default 0.5 = 50%%)")
+    parser.add_argument('--repeat', type=int, default=11, help="timed batches per case (the median is reported)")
+    parser.add_argument('--quick', action='store_true', help="small grids and car counts only")
+    args = parser.parse_args(argv)
+    
+    baseline = None
+    iterations = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        # Time the same batches as the baseline did
+        iterations = {name: result['iterations'] for name, result in baseline.get('results', {}).items()
+                      if 'iterations' in result}
+    
+    print("=" * 60)
+    print("BENCHMARK SUITE")
+    print("=" * 60)
+    if args.quick:
+        results = run_suite(grid_sizes=(31, 101), car_counts=(100,), repeat=args.repeat, iterations=iterations)
+    else:
+        results = run_suite(repeat=args.repeat, iterations=iterations)
+    report = {'environment': environment(), 'tolerance': args.tolerance, 'results': results}
+    
+    with open(args.json, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {args.json}")
+    if args.save_baseline:
+        with open(BASELINE_FILE, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline written to {BASELINE_FILE}")
+    
+    if baseline is not None:
+        if any('reference_ms' not in result for result in baseline.get('results', {}).values()):
+            print(f"\n{args.baseline} has cases without reference timings; re-record it with --save-baseline")
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) against {args.baseline}:")
+            for name, base_ms, ms, ratio in regressions:
+                print(f"  {name:<45} {base_ms:>9.3f} -> {ms:>9.3f} ms ({ratio:.2f}x)")
+            return 1
+        print(f"\nNo regressions against {args.baseline} (tolerance {args.tolerance:.0%})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,15 +1,23 @@
-import pygame
+try:
+    import pygame
+except ImportError:  # Headless runs (SimulationEngine) work without pygame
+    pygame = None
+import bisect
+import hashlib
 import heapq
+import json
 import random
+import time
+from array import array
+
+import numpy as np
 import copy
-from collections import deque, defaultdict
+from collections import deque, defaultdict, OrderedDict
 import sys
 
 # Constants
-GRID_SIZE = 31
-CELL_SIZE = 25
-WINDOW_WIDTH = GRID_SIZE * CELL_SIZE
-WINDOW_HEIGHT = GRID_SIZE * CELL_SIZE + 100
+GRID_SIZE = 31  # Default LotLayout size
+CELL_SIZE = 25  # Cars move in pixels of this cell size; LotLayout.cell_size only affects drawing
 
 # Colors
 ROAD_COLOR = (128, 128, 128)  # Grey
@@ -28,40 +36,737 @@ EXIT_POINTS = [(30, 0), (30, 15), (30, 30)]
 # Deadlock detection
 DEADLOCK_THRESHOLD = 180  # 3 seconds at 60fps
 
+# Cell type codes used by ParkingLot.cells
+CELL_NONE = 0
+CELL_ROAD = 1
+CELL_PARKING = 2
+CELL_CODES = {'road': CELL_ROAD, 'parking': CELL_PARKING}
+
+# Largest lot drawing (in pixels) a layout picks its default cell size for
+MAX_LOT_PIXELS = 800
+
+# Stall status codes used by ParkingLot.status_grid (-1 for cells that are not stalls)
+STATUS_CODES = {'empty': 0, 'reserved': 1, 'occupied': 2}
+
+class LotLayout:
+    """Dimensions, aisle pattern and gates of a parking lot.
+
+    The outer ring of cells is road. Inside it, rows repeat ``stall_rows``
+    parking rows followed by ``road_rows`` road rows, and within parking
+    rows columns repeat ``stall_cols`` stalls followed by ``road_cols`` road
+    columns. The default is the original 31x31 lot: 2 parking rows / 1 road
+    row, 5 stalls / 1 road column, entries down the left edge and exits
+    along the bottom. ``cell_size`` is the drawn size of a cell in pixels;
+    by default it shrinks so the lot fits in MAX_LOT_PIXELS.
+    """
+    def __init__(self, rows=GRID_SIZE, cols=None, stall_rows=2, road_rows=1, stall_cols=5, road_cols=1,
+                 entry_points=None, exit_points=None, cell_size=None):
+        self.rows = rows
+        self.cols = cols = rows if cols is None else cols
+        self.stall_rows = stall_rows
+        self.road_rows = road_rows
+        self.stall_cols = stall_cols
+        self.road_cols = road_cols
+        if entry_points is None:
+            entry_points = [(0, 0), (rows // 2, 0), (rows - 1, 0)]
+        if exit_points is None:
+            exit_points = [(rows - 1, 0), (rows - 1, cols // 2), (rows - 1, cols - 1)]
+        self.entry_points = list(entry_points)
+        self.exit_points = list(exit_points)
+        if cell_size is None:
+            cell_size = max(1, min(CELL_SIZE, MAX_LOT_PIXELS // max(rows, cols)))
+        self.cell_size = cell_size
+        
+        for row, col in self.entry_points + self.exit_points:
+            if not (0 <= row < rows and 0 <= col < cols) or self.cell_type(row, col) != 'road':
+                raise ValueError(f"Gate {(row, col)} is not a road cell of a {rows}x{cols} lot")
+    
+    def cell_type(self, row, col):
+        """'road' or 'parking' for a cell"""
+        # The outer ring is road
+        if row == 0 or row == self.rows - 1 or col == 0 or col == self.cols - 1:
+            return 'road'
+        # Inside: stall_rows parking rows, then road_rows road rows, repeat
+        if (row - 1) % (self.stall_rows + self.road_rows) >= self.stall_rows:
+            return 'road'
+        # Parking row: stall_cols stalls, then road_cols road columns, repeat
+        if (col - 1) % (self.stall_cols + self.road_cols) >= self.stall_cols:
+            return 'road'
+        return 'parking'
+    
+    @property
+    def window_size(self):
+        """(width, height) of a window showing the lot and the stats panel below it"""
+        return self.cols * self.cell_size, self.rows * self.cell_size + 100
+
+
+class RoadGraph:
+    """Road network of a lot compiled once into compact CSR arrays.
+
+    For every cell ``i`` (flat index ``row * size + col``, where ``size`` is
+    the row width) the road cells next
+    to it are ``neighbors[offsets[i]:offsets[i + 1]]`` and the parking cells
+    next to it are ``parking[parking_offsets[i]:parking_offsets[i + 1]]``, both
+    in the order right, down, left, up.
+    """
+    def __init__(self, cells):
+        self.rows, self.cols = rows, cols = cells.shape
+        self.size = cols
+        self.node_count = rows * cols
+        flat = cells.reshape(-1)
+        self.is_road = bytearray((flat == CELL_ROAD).astype(np.uint8).tobytes())
+        self.is_parking = bytearray((flat == CELL_PARKING).astype(np.uint8).tobytes())
+        
+        # Candidate neighbour of every cell in each direction, -1 off the grid
+        nodes = np.arange(self.node_count).reshape(rows, cols)
+        candidates = np.full((rows, cols, 4), -1, dtype=np.int64)
+        candidates[:, :-1, 0] = nodes[:, 1:]   # right
+        candidates[:-1, :, 1] = nodes[1:, :]   # down
+        candidates[:, 1:, 2] = nodes[:, :-1]   # left
+        candidates[1:, :, 3] = nodes[:-1, :]   # up
+        candidates = candidates.reshape(self.node_count, 4)
+        kinds = np.where(candidates >= 0, flat[candidates], CELL_NONE)
+        
+        self.offsets, self.neighbors = self._csr(candidates, kinds == CELL_ROAD)
+        self.parking_offsets, self.parking = self._csr(candidates, kinds == CELL_PARKING)
+    
+    @staticmethod
+    def _csr(candidates, mask):
+        """Offset and target arrays keeping the masked candidates, row by row"""
+        offsets = np.zeros(len(candidates) + 1, dtype=np.int32)
+        np.cumsum(mask.sum(axis=1), out=offsets[1:])
+        targets = candidates[mask].astype(np.int32)
+        return array('i', offsets.tobytes()), array('i', targets.tobytes())
+    
+    def road_neighbors(self, node):
+        """Flat indices of the road cells next to a node"""
+        return self.neighbors[self.offsets[node]:self.offsets[node + 1]]
+    
+    def adjacent_parking(self, node):
+        """Flat indices of the parking cells next to a node"""
+        return self.parking[self.parking_offsets[node]:self.parking_offsets[node + 1]]
+
+
+class PathFinder:
+    """Shared Dijkstra engine over a flat, integer-indexed road grid.
+
+    Node ``i`` is the cell ``divmod(i, cols)``. Searches keep parent
+    pointers and a closed set instead of copying paths on every relaxation,
+    skip stale heap entries, and rebuild the path only when a goal is found.
+    The per-node arrays are reused between searches; only the entries a
+    search touched are reset afterwards.
+    """
+    def __init__(self, parking_lot):
+        self.parking_lot = parking_lot
+        self.graph = parking_lot.graph
+        self.size = self.graph.size
+        node_count = self.graph.node_count
+        self.dist = [float('inf')] * node_count
+        self.parent = [-1] * node_count
+        self.closed = bytearray(node_count)
+        self.nodes_expanded = 0  # Nodes settled by the most recent search
+        self.total_expanded = 0  # Nodes settled by all searches so far
+        self.search_count = 0
+    
+    def index(self, pos):
+        """Flat node index of a (row, col) cell"""
+        return pos[0] * self.size + pos[1]
+    
+    def position(self, node):
+        """(row, col) cell of a flat node index"""
+        return divmod(node, self.size)
+    
+    def search(self, sources, goal_mask, goal_value, heuristic=None, bound=None):
+        """Run Dijkstra from one or more source cells to the nearest goal node.
+        
+        ``goal_mask[node]`` is truthy for goal nodes; ``goal_value(node)`` is
+        only called for the goal that is reached. With a ``heuristic(node)``
+        lower bound on the remaining cost the search runs as A*; the bound
+        must be consistent (change by at most one cell's weight per step).
+        With ``bound=(remaining, budget)``, where ``remaining[node]`` is a
+        lower bound on the cost left from node, cells that cannot reach a
+        goal within budget are never queued; the others are settled in the
+        same order, with the same tie-breaks, as without it.
+        Returns (path, goal_value, cost), or (None, None, inf) when no goal
+        is reachable.
+        """
+        dist = self.dist
+        parent = self.parent
+        closed = self.closed
+        weight = self.parking_lot.weights_flat.item
+        offsets = self.graph.offsets
+        road_neighbors = self.graph.neighbors
+        remaining, budget = bound if bound is not None else (None, float('inf'))
+        touched = []
+        heap = []
+        estimates = {}  # A* heuristic per node, evaluated once per search
+        for pos in sources:
+            node = self.index(pos)
+            if dist[node] > 0:
+                dist[node] = 0
+                touched.append(node)
+                if heuristic is None:
+                    heap.append((0, node))
+                else:
+                    estimates[node] = heuristic(node)
+                    heap.append((estimates[node], node))
+        heapq.heapify(heap)
+        
+        expanded = 0
+        result = None, None, float('inf')
+        while heap:
+            node = heapq.heappop(heap)[1]
+            if closed[node]:
+                continue  # Stale entry for an already settled node
+            closed[node] = 1
+            expanded += 1
+            cost = dist[node]
+            
+            if goal_mask[node]:
+                result = self.reconstruct(node), goal_value(node), cost
+                break
+            
+            for neighbor in road_neighbors[offsets[node]:offsets[node + 1]]:
+                if closed[neighbor]:
+                    continue
+                new_cost = cost + weight(neighbor)
+                if new_cost < dist[neighbor]:
+                    if remaining is not None and new_cost + remaining[neighbor] > budget:
+                        continue
+                    if dist[neighbor] == float('inf'):
+                        touched.append(neighbor)
+                    dist[neighbor] = new_cost
+                    parent[neighbor] = node
+                    if heuristic is None:
+                        heapq.heappush(heap, (new_cost, neighbor))
+                    else:
+                        estimate = estimates.get(neighbor)
+                        if estimate is None:
+                            estimate = estimates[neighbor] = heuristic(neighbor)
+                        heapq.heappush(heap, (new_cost + estimate, neighbor))
+        
+        for node in touched:
+            dist[node] = float('inf')
+            parent[node] = -1
+            closed[node] = 0
+        self.nodes_expanded = expanded
+        self.total_expanded += expanded
+        self.search_count += 1
+        return result
+    
+    def search_many(self, source, goal_mask, goal_values, limit):
+        """Run Dijkstra from source until `limit` goals are found, nearest first.
+        
+        Unlike ``search`` the search goes on past the first goal node:
+        ``goal_values(node)`` lists the goals a settled goal node offers
+        (possibly none, or several; a goal offered by several nodes counts
+        once, at the cheapest). Returns up to `limit` (path, goal, cost)
+        tuples in order of cost.
+        """
+        dist = self.dist
+        parent = self.parent
+        closed = self.closed
+        weight = self.parking_lot.weights_flat.item
+        offsets = self.graph.offsets
+        road_neighbors = self.graph.neighbors
+        node = self.index(source)
+        dist[node] = 0
+        touched = [node]
+        heap = [(0, node)]
+        
+        expanded = 0
+        results = []
+        found = set()
+        while heap and len(results) < limit:
+            node = heapq.heappop(heap)[1]
+            if closed[node]:
+                continue
+            closed[node] = 1
+            expanded += 1
+            cost = dist[node]
+            
+            if goal_mask[node]:
+                values = [value for value in goal_values(node) if value not in found]
+                if values:
+                    path = self.reconstruct(node)
+                    for value in values[:limit - len(results)]:
+                        found.add(value)
+                        results.append((path, value, cost))
+            
+            for neighbor in road_neighbors[offsets[node]:offsets[node + 1]]:
+                if closed[neighbor]:
+                    continue
+                new_cost = cost + weight(neighbor)
+                if new_cost < dist[neighbor]:
+                    if dist[neighbor] == float('inf'):
+                        touched.append(neighbor)
+                    dist[neighbor] = new_cost
+                    parent[neighbor] = node
+                    heapq.heappush(heap, (new_cost, neighbor))
+        
+        for node in touched:
+            dist[node] = float('inf')
+            parent[node] = -1
+            closed[node] = 0
+        self.nodes_expanded = expanded
+        self.total_expanded += expanded
+        self.search_count += 1
+        return results
+    
+    def reconstruct(self, node):
+        """Follow parent pointers back to the source and return the path"""
+        parent = self.parent
+        path = []
+        while node != -1:
+            path.append(divmod(node, self.size))
+            node = parent[node]
+        path.reverse()
+        return path
+
+
+class ExitField:
+    """Distance and next-hop table from every road cell to its nearest exit.
+
+    Built by one reverse Dijkstra seeded from all exits at once; routes are
+    traced by a forward search bounded by these distances, which only visits
+    cells on a cheapest route. Weight changes only mark cells dirty
+    (remembering their previous weight); the next query repairs just the
+    part of the shortest-path tree hanging below cells that got more
+    expensive, re-expands from cells that got cheaper, and falls back to a
+    full rebuild when too much has changed.
+    """
+    REBUILD_FRACTION = 0.25  # Rebuild from scratch above this share of affected cells
+    
+    def __init__(self, parking_lot, exit_points):
+        self.parking_lot = parking_lot
+        self.graph = parking_lot.graph
+        self.exit_points = list(exit_points)
+        self.exit_nodes = [self.graph.size * row + col for row, col in self.exit_points]
+        self.dist = [float('inf')] * self.graph.node_count
+        self.next_hop = [-1] * self.graph.node_count
+        # Weight each dirty cell had when the table was last valid (NaN = clean)
+        self.dirty_weights = np.full(self.graph.node_count, np.nan)
+        self.dirty_nodes = []   # Single dirty cells ...
+        self.dirty_chunks = []  # ... and arrays of them, in marking order
+        self.valid = False
+        self.rebuilds = 0
+        self.repairs = 0
+    
+    def mark_dirty(self, node, old_weight):
+        """Record that the weight of a road cell changed from old_weight"""
+        if self.valid and self.dirty_weights.item(node) != self.dirty_weights.item(node):
+            self.dirty_weights[node] = old_weight
+            self.dirty_nodes.append(node)
+    
+    def mark_dirty_many(self, nodes, old_weights):
+        """mark_dirty for arrays of nodes and their previous weights"""
+        if self.valid:
+            clean = np.isnan(self.dirty_weights[nodes])
+            nodes = nodes[clean]
+            if len(nodes):  # Cells already dirty add nothing; don't grow the list while no one asks
+                self.dirty_weights[nodes] = old_weights[clean]
+                self.dirty_chunks.append(nodes)
+    
+    def is_dirty(self):
+        """True if weights changed since the table was last brought up to date"""
+        return bool(self.dirty_nodes or self.dirty_chunks)
+    
+    def _clear_dirty(self):
+        """Forget all recorded weight changes"""
+        self.dirty_weights.fill(np.nan)
+        self.dirty_nodes = []
+        self.dirty_chunks = []
+    
+    def invalidate(self):
+        """Force a full rebuild on the next query (e.g. after bulk weight edits)"""
+        self.valid = False
+        self._clear_dirty()
+    
+    def refresh(self):
+        """Bring the table up to date with the current road weights"""
+        if not self.valid:
+            self.rebuild()
+        elif self.is_dirty():
+            self.repair()
+    
+    def rebuild(self):
+        """Recompute the whole table from the exits"""
+        dist = self.dist
+        next_hop = self.next_hop
+        for node in range(self.graph.node_count):
+            dist[node] = float('inf')
+            next_hop[node] = -1
+        heap = []
+        for node in self.exit_nodes:
+            dist[node] = 0
+            heap.append((0, node))
+        heapq.heapify(heap)
+        self._propagate(heap)
+        self._clear_dirty()
+        self.valid = True
+        self.rebuilds += 1
+    
+    def repair(self):
+        """Update only the cells whose distance can depend on the dirty cells"""
+        dist = self.dist
+        next_hop = self.next_hop
+        offsets = self.graph.offsets
+        neighbors = self.graph.neighbors
+        
+        nodes = np.concatenate([np.array(self.dirty_nodes, dtype=np.intp)] + self.dirty_chunks)
+        new_weights = self.parking_lot.weights_flat[nodes]
+        old_weights = self.dirty_weights[nodes]
+        increased = nodes[new_weights > old_weights].tolist()
+        decreased = nodes[new_weights < old_weights].tolist()
+        self.dirty_weights[nodes] = np.nan
+        self.dirty_nodes = []
+        self.dirty_chunks = []
+        if not increased and not decreased:
+            return
+        
+        # A cell's distance includes the weight of every cell after it on its
+        # route, so cells routed through a more expensive cell lose their label.
+        limit = self.graph.node_count * self.REBUILD_FRACTION
+        affected = set()
+        stack = increased[:]
+        while stack:
+            node = stack.pop()
+            for i in range(offsets[node], offsets[node + 1]):
+                child = neighbors[i]
+                if next_hop[child] == node and child not in affected:
+                    affected.add(child)
+                    stack.append(child)
+            if len(affected) > limit:
+                self.rebuild()
+                return
+        for node in affected:
+            dist[node] = float('inf')
+            next_hop[node] = -1
+        
+        # Re-expand from the intact cells bordering the affected region and
+        # from cheaper cells, which may now shorten their neighbours' routes.
+        seeds = set(decreased)
+        for node in affected:
+            for i in range(offsets[node], offsets[node + 1]):
+                other = neighbors[i]
+                if other not in affected:
+                    seeds.add(other)
+        heap = [(dist[node], node) for node in seeds if dist[node] < float('inf')]
+        heapq.heapify(heap)
+        self._propagate(heap)
+        self.repairs += 1
+    
+    def _propagate(self, heap):
+        """Reverse Dijkstra: entering cell u from v costs the weight of u"""
+        dist = self.dist
+        next_hop = self.next_hop
+        weight = self.parking_lot.weights_flat.item
+        offsets = self.graph.offsets
+        neighbors = self.graph.neighbors
+        while heap:
+            cost, node = heapq.heappop(heap)
+            if cost > dist[node]:
+                continue  # Stale entry
+            new_cost = cost + weight(node)
+            for i in range(offsets[node], offsets[node + 1]):
+                other = neighbors[i]
+                if new_cost < dist[other]:
+                    dist[other] = new_cost
+                    next_hop[other] = node
+                    heapq.heappush(heap, (new_cost, other))
+    
+    def route_from(self, start_positions):
+        """Cheapest route to an exit from any of the start cells.
+        
+        Picks the first start cell with the lowest cost, then traces its
+        route with a forward search that only queues cells whose distance
+        here keeps them on a cheapest route. Among equally cheap routes that
+        gives the exit and path a plain forward search from that cell finds
+        (next_hop alone would settle ties from the exit end instead).
+        Returns (path, exit_point, cost), or (None, None, inf) if no exit is
+        reachable.
+        """
+        self.refresh()
+        size = self.graph.size
+        best_pos = None
+        best_cost = float('inf')
+        for row, col in start_positions:
+            cost = self.dist[row * size + col]
+            if cost < best_cost:
+                best_pos = (row, col)
+                best_cost = cost
+        if best_pos is None:
+            return None, None, float('inf')
+        
+        budget = best_cost + 1e-9 * max(1.0, best_cost)  # Slack for float sums taken in another order
+        return self.parking_lot.pathfinder.search([best_pos], self.parking_lot.exit_mask,
+                                                  lambda node: divmod(node, size), bound=(self.dist, budget))
+
+
+class RouteCache:
+    """Bounded LRU cache of routes, keyed by search kind and start cell(s).
+
+    Entries remember the lot's ``weight_epoch`` (number of weight updates)
+    and are served as is until the next update, so the default
+    ``tolerance=0`` leaves a run exactly as without the cache. With a
+    tolerance above 0 (a fraction) a route is also served while its cost,
+    re-priced along its own cells with the current weights, rose by at
+    most that much. Cheaper routes elsewhere are not looked for, so a
+    served route can be worse than a fresh search by more than the
+    tolerance. Parking routes are dropped once any stall is freed (it
+    might be closer); when their stall was taken they are re-pointed at
+    the first empty stall next to their last cell, or dropped if there is
+    none.
+
+    With ``audit_every=n`` every n-th hit is searched again without the
+    cache, and stats() reports how much dearer the served routes were
+    than the best ones.
+    """
+    def __init__(self, parking_lot, max_size=1024, tolerance=0.0, audit_every=0):
+        self.parking_lot = parking_lot
+        self.max_size = max_size
+        self.tolerance = tolerance
+        self.audit_every = audit_every
+        self.routes = OrderedDict()  # key -> (path, goal, cost, weight epoch, stalls freed)
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0  # Entries found but no longer good enough to serve
+        self.evictions = 0
+        self.stale_epochs = 0  # Sum over hits of the weight updates the served route predates
+        self.cost_rise = 0.0  # Sum over hits of the relative cost increase of the served route
+        self.audited = 0
+        self.audited_worse = 0  # Audited hits dearer than a fresh search
+        self.excess_cost = 0.0  # Sum over audited hits of the served cost over the best cost, minus 1
+    
+    def get(self, key, parking=False, search=None):
+        """Cached (path, goal, cost) for key, or None if absent or stale.
+        
+        search (the uncached search, taking no arguments) is only needed
+        for audits.
+        """
+        entry = self.routes.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        lot = self.parking_lot
+        path, goal, cost, epoch, freed = entry
+        result = self._revalidate(path, goal, cost, epoch, freed, parking)
+        if result is None:
+            del self.routes[key]
+            self.stale += 1
+            self.misses += 1
+            return None
+        self.routes.move_to_end(key)
+        self.hits += 1
+        self.stale_epochs += lot.weight_epoch - epoch
+        if cost > 0:
+            self.cost_rise += result[2] / cost - 1
+        if self.audit_every and search is not None and self.hits % self.audit_every == 0:
+            best = search()[2]
+            self.audited += 1
+            if result[2] > best * (1 + 1e-9):
+                self.audited_worse += 1
+            if best > 0:
+                self.excess_cost += result[2] / best - 1
+        return result
+    
+    def _revalidate(self, path, goal, cost, epoch, freed, parking):
+        """The entry as it stands now, or None if it may no longer be served"""
+        lot = self.parking_lot
+        exact = epoch == lot.weight_epoch
+        if not exact and self.tolerance <= 0:
+            return None
+        if parking:
+            if freed != lot.stalls_freed:
+                return None
+            if lot.parking_status[goal] != 'empty':
+                goal = next((stall for stall in lot.get_adjacent_parking(path[-1])
+                             if lot.parking_status[stall] == 'empty'), None)
+                if goal is None:
+                    return None
+        if not exact:
+            # A route costs the weights of the cells it enters (all but the start)
+            nodes = lot.path_road_nodes(path[1:])
+            new_cost = float(lot.weights_flat[nodes].sum()) if len(nodes) else 0.0
+            if new_cost > cost * (1 + self.tolerance):
+                return None
+            cost = new_cost
+        return path, goal, cost
+    
+    def put(self, key, result):
+        """Store a search result (routes that found nothing are not cached)"""
+        path, goal, cost = result
+        if path is None:
+            return
+        lot = self.parking_lot
+        self.routes[key] = (path, goal, cost, lot.weight_epoch, lot.stalls_freed)
+        self.routes.move_to_end(key)
+        if len(self.routes) > self.max_size:
+            self.routes.popitem(last=False)
+            self.evictions += 1
+    
+    def clear(self):
+        """Drop every route (e.g. after editing road_weights directly)"""
+        self.routes.clear()
+    
+    def stats(self):
+        """Hit rate, evictions and how stale the served routes were on average.
+        
+        mean_cost_rise compares served routes with their cost when cached;
+        mean_excess_cost and worse_rate compare audited hits with a fresh
+        search, which is what the cache costs in route quality.
+        """
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'stale': self.stale, 'evictions': self.evictions,
+                'size': len(self.routes), 'hit_rate': self.hits / lookups if lookups else 0.0,
+                'mean_stale_epochs': self.stale_epochs / self.hits if self.hits else 0.0,
+                'mean_cost_rise': self.cost_rise / self.hits if self.hits else 0.0,
+                'audited': self.audited,
+                'mean_excess_cost': self.excess_cost / self.audited if self.audited else 0.0,
+                'worse_rate': self.audited_worse / self.audited if self.audited else 0.0}
+
+
 class ParkingLot:
-    def __init__(self):
-        self.grid = [[None for _ in range(GRID_SIZE)] for _ in range(GRID_SIZE)]
-        self.road_weights = [[1.0 for _ in range(GRID_SIZE)] for _ in range(GRID_SIZE)]
+    # Lower bound on the weight of any road cell (weights are clamped to it)
+    MIN_WEIGHT = 1.0
+    
+    def __init__(self, layout=None, parking_search='dijkstra', parking_status=None):
+        self.layout = layout = layout if layout is not None else LotLayout()
+        self.grid = [[None for _ in range(layout.cols)] for _ in range(layout.rows)]
+        # Weights live in a float array; update it in place, never rebind it,
+        # since weights_flat is a flat view of the same memory
+        self.road_weights = np.ones((layout.rows, layout.cols))
+        self.weights_flat = self.road_weights.reshape(-1)
         self.parking_status = {}  # (row, col): 'empty', 'reserved', 'occupied'
         self.road_occupancy = {}  # (row, col): car_id or None
+        self.on_road_freed = None  # Optional callback(pos), e.g. to wake cars waiting for pos
+        # Versioning for RouteCache: weight updates and stalls that became empty so far
+        self.weight_epoch = 0
+        self.stalls_freed = 0
+        self.route_cache = None  # RouteCache, once enable_route_cache is called
+        self.parking_search = parking_search  # 'dijkstra' or 'astar'
         self.initialize_grid()
+        if parking_status is not None:
+            # Stalls to start in another status than 'empty' (a restored checkpoint);
+            # applied before indexing so the status indexes are built only once
+            self.parking_status.update(parking_status)
+        self.cells = np.array([[CELL_CODES.get(cell, CELL_NONE) for cell in row] for row in self.grid],
+                              dtype=np.int8)
+        self.cells_flat = self.cells.reshape(-1)
+        self.road_nodes = np.flatnonzero(self.cells_flat == CELL_ROAD)
+        self.graph = RoadGraph(self.cells)
+        self.pathfinder = PathFinder(self)
+        self.exit_field = ExitField(self, layout.exit_points)
+        self.exit_mask = bytearray(self.graph.node_count)
+        for row, col in layout.exit_points:
+            self.exit_mask[row * self.graph.size + col] = 1
+        self.index_parking_status()
+        
+    def index_parking_status(self):
+        """Build the per-status sets and the per-road empty stall counts.
+        
+        parking_status must only be changed through reserve_parking,
+        occupy_parking and free_parking afterwards, which keep these indexes
+        in sync: status_sets[status] holds the stalls in each status,
+        status_grid holds each stall's STATUS_CODES value (for rendering),
+        empty_adjacent[node] counts the empty stalls next to each road cell
+        and empty_by_row[row] is the sorted list of empty stall columns in a
+        row (empty_rows lists the rows that have any).
+        """
+        self.status_sets = {'empty': set(), 'reserved': set(), 'occupied': set()}
+        self.status_grid = np.full(self.cells.shape, -1, dtype=np.int8)
+        self.empty_adjacent = [0] * self.graph.node_count
+        self.empty_by_row = {}
+        self.empty_rows = []
+        for parking_pos, status in sorted(self.parking_status.items()):
+            self.status_sets[status].add(parking_pos)
+            self.status_grid[parking_pos] = STATUS_CODES[status]
+            if status == 'empty':
+                self._count_empty(parking_pos, 1)
+    
+    def _count_empty(self, parking_pos, delta):
+        """Add (+1) or remove (-1) a stall from the empty stall indexes"""
+        size = self.graph.size
+        row, col = parking_pos
+        for node in self.graph.road_neighbors(row * size + col):
+            self.empty_adjacent[node] += delta
+        
+        cols = self.empty_by_row.get(row)
+        if delta > 0:
+            if cols is None:
+                cols = self.empty_by_row[row] = []
+                bisect.insort(self.empty_rows, row)
+            bisect.insort(cols, col)
+        else:
+            del cols[bisect.bisect_left(cols, col)]
+            if not cols:
+                del self.empty_by_row[row]
+                del self.empty_rows[bisect.bisect_left(self.empty_rows, row)]
+    
+    def nearest_empty_distance(self, pos):
+        """Manhattan distance from a cell to the closest empty stall (inf if none)"""
+        row, col = pos
+        rows = self.empty_rows
+        by_row = self.empty_by_row
+        best = float('inf')
+        above = bisect.bisect_left(rows, row) - 1
+        below = above + 1
+        # Walk outwards from the cell's row; stop once rows are too far away
+        while True:
+            if below < len(rows) and (above < 0 or rows[below] - row <= row - rows[above]):
+                other = rows[below]
+                below += 1
+                row_distance = other - row
+            elif above >= 0:
+                other = rows[above]
+                above -= 1
+                row_distance = row - other
+            else:
+                return best
+            if row_distance >= best:
+                return best
+            cols = by_row[other]
+            i = bisect.bisect_left(cols, col)
+            if i < len(cols):
+                col_distance = cols[i] - col
+                if i and col - cols[i - 1] < col_distance:
+                    col_distance = col - cols[i - 1]
+            else:
+                col_distance = col - cols[i - 1]
+            if row_distance + col_distance < best:
+                best = row_distance + col_distance
+    
+    def _set_parking_status(self, parking_pos, status):
+        """Change a stall's status and keep the status indexes in sync"""
+        old_status = self.parking_status.get(parking_pos)
+        if old_status is None or old_status == status:
+            return
+        self.parking_status[parking_pos] = status
+        self.status_sets[old_status].discard(parking_pos)
+        self.status_sets[status].add(parking_pos)
+        self.status_grid[parking_pos] = STATUS_CODES[status]
+        if old_status == 'empty':
+            self._count_empty(parking_pos, -1)
+        elif status == 'empty':
+            self._count_empty(parking_pos, 1)
+            self.stalls_freed += 1
+    
+    def status_count(self, status):
+        """Number of stalls currently in the given status"""
+        return len(self.status_sets[status])
+    
+    def has_empty_parking(self):
+        """True if at least one stall is empty"""
+        return bool(self.status_sets['empty'])
         
     def initialize_grid(self):
-        """Initialize the 31x31 parking lot grid"""
-        for row in range(GRID_SIZE):
-            for col in range(GRID_SIZE):
-                # First and last rows are roads
-                if row == 0 or row == GRID_SIZE - 1:
-                    self.grid[row][col] = 'road'
-                # First and last columns are roads
-                elif col == 0 or col == GRID_SIZE - 1:
-                    self.grid[row][col] = 'road'
-                else:
-                    # Inside the perimeter: alternating pattern
-                    # 2 parking rows, 1 road row, repeat
-                    inner_row = row - 1
-                    row_type = inner_row % 3
-                    
-                    if row_type == 2:  # Road row
-                        self.grid[row][col] = 'road'
-                    else:  # Parking row
-                        # 5 parking spaces, 1 road segment, repeat
-                        col_type = (col - 1) % 6
-                        if col_type == 5:  # Road segment
-                            self.grid[row][col] = 'road'
-                        else:  # Parking space
-                            self.grid[row][col] = 'parking'
-                            self.parking_status[(row, col)] = 'empty'
+        """Fill the grid from the layout; every stall starts empty"""
+        layout = self.layout
+        for row in range(layout.rows):
+            for col in range(layout.cols):
+                self.grid[row][col] = layout.cell_type(row, col)
+                if self.grid[row][col] == 'parking':
+                    self.parking_status[(row, col)] = 'empty'
     
     def is_road_occupied(self, pos):
         """Check if a road segment is occupied by another car"""
@@ -69,149 +774,320 @@ class ParkingLot:
     
     def occupy_road(self, pos, car_id):
         """Mark a road segment as occupied by a car"""
-        if self.grid[pos[0]][pos[1]] == 'road':
+        if self.graph.is_road[self.pathfinder.index(pos)]:
             self.road_occupancy[pos] = car_id
     
     def free_road(self, pos):
         """Free a road segment"""
         if pos in self.road_occupancy:
             self.road_occupancy[pos] = None
+            if self.on_road_freed is not None:
+                self.on_road_freed(pos)
     
     def get_neighbors(self, pos):
         """Get valid neighboring road segments"""
-        row, col = pos
-        neighbors = []
-        directions = [(0, 1), (1, 0), (0, -1), (-1, 0)]
-        
-        for dr, dc in directions:
-            new_row, new_col = row + dr, col + dc
-            if 0 <= new_row < GRID_SIZE and 0 <= new_col < GRID_SIZE:
-                if self.grid[new_row][new_col] == 'road':
-                    neighbors.append((new_row, new_col))
-        return neighbors
+        size = self.graph.size
+        return [divmod(node, size) for node in self.graph.road_neighbors(pos[0] * size + pos[1])]
     
     def get_adjacent_parking(self, pos):
         """Get adjacent parking spaces from a road position"""
-        row, col = pos
-        parking_spaces = []
-        directions = [(0, 1), (1, 0), (0, -1), (-1, 0)]
-        
-        for dr, dc in directions:
-            new_row, new_col = row + dr, col + dc
-            if 0 <= new_row < GRID_SIZE and 0 <= new_col < GRID_SIZE:
-                if self.grid[new_row][new_col] == 'parking':
-                    parking_spaces.append((new_row, new_col))
-        return parking_spaces
-    
-    def find_shortest_path_to_parking(self, start_pos, exclude_parking=False):
-        """Modified BFS with weights to find shortest path to closest empty parking"""
-        # Priority queue: (cost, position, path)
-        pq = [(0, start_pos, [start_pos])]
-        visited = {start_pos: 0}
-        
-        while pq:
-            cost, pos, path = heapq.heappop(pq)
-            
-            # Check if we can reach an empty parking space from this position
-            if not exclude_parking:
-                adjacent_parking = self.get_adjacent_parking(pos)
-                for parking_pos in adjacent_parking:
-                    if self.parking_status.get(parking_pos) == 'empty':
-                        return path, parking_pos, cost
+        size = self.graph.size
+        return [divmod(node, size) for node in self.graph.adjacent_parking(pos[0] * size + pos[1])]
+    
+    def find_shortest_path_to_parking(self, start_pos, exclude_parking=False, search=None):
+        """Modified BFS with weights to find shortest path to closest empty parking
+        
+        search overrides self.parking_search: 'dijkstra' floods outwards by
+        cost, 'astar' is steered towards the nearest empty stall by a
+        Manhattan distance bound. Both return a cheapest path;
+        pathfinder.nodes_expanded reports how much work it took.
+        """
+        if not exclude_parking and not self.has_empty_parking():
+            return None, None, float('inf')  # Nothing to find; skip the search
+        if exclude_parking:
+            # Nothing is ever accepted: the search just floods the network
+            self.pathfinder.search([start_pos], bytearray(self.graph.node_count), None)
+            return None, None, float('inf')
+        mode = search or self.parking_search
+        if self.route_cache is not None:
+            key = ('parking', mode, start_pos)
+            result = self.route_cache.get(key, parking=True,
+                                          search=lambda: self._search_parking(start_pos, mode))
+            if result is None:
+                result = self._search_parking(start_pos, mode)
+                self.route_cache.put(key, result)
+            return result
+        return self._search_parking(start_pos, mode)
+    
+    def _search_parking(self, start_pos, mode):
+        """Uncached parking search for find_shortest_path_to_parking"""
+        status = self.parking_status
+        size = self.graph.size
+        offsets = self.graph.parking_offsets
+        parking = self.graph.parking
+        
+        def empty_adjacent_parking(node):
+            # First empty stall next to the road cell, in right/down/left/up order
+            for i in range(offsets[node], offsets[node + 1]):
+                parking_pos = divmod(parking[i], size)
+                if status[parking_pos] == 'empty':
+                    return parking_pos
+        
+        heuristic = None
+        if mode == 'astar':
+            min_weight = self.MIN_WEIGHT
             
-            # Explore neighbors
-            for neighbor in self.get_neighbors(pos):
-                new_cost = cost + self.road_weights[neighbor[0]][neighbor[1]]
-                
-                if neighbor not in visited or new_cost < visited[neighbor]:
-                    visited[neighbor] = new_cost
-                    new_path = path + [neighbor]
-                    heapq.heappush(pq, (new_cost, neighbor, new_path))
+            def heuristic(node):
+                # Reaching a road next to stall s takes at least |node - s| - 1
+                # steps, each costing at least MIN_WEIGHT
+                return max(0, self.nearest_empty_distance(divmod(node, size)) - 1) * min_weight
         
-        return None, None, float('inf')
+        # Roads with an empty stall next to them are the goals
+        return self.pathfinder.search([start_pos], self.empty_adjacent, empty_adjacent_parking, heuristic)
     
     def find_shortest_path_to_exit(self, start_pos):
         """Find shortest path from parking to nearest exit point"""
-        # Priority queue: (cost, position, path)
-        pq = [(0, start_pos, [start_pos])]
-        visited = {start_pos: 0}
+        return self.find_shortest_path_to_exit_from([start_pos])
+    
+    def find_shortest_path_to_exit_from(self, start_positions):
+        """Find the cheapest path to the nearest exit from any of several start cells"""
+        if self.route_cache is not None:
+            key = ('exit', tuple(start_positions))
+            result = self.route_cache.get(key, search=lambda: self.exit_field.route_from(start_positions))
+            if result is None:
+                result = self.exit_field.route_from(start_positions)
+                self.route_cache.put(key, result)
+            return result
+        return self.exit_field.route_from(start_positions)
+    
+    def rank_exit_paths(self, start_pos, exclude=(), limit=None):
+        """Cheapest path to each exit from start_pos, cheapest first, in one search.
         
-        while pq:
-            cost, pos, path = heapq.heappop(pq)
-            
-            # Check if we reached an exit point
-            if pos in EXIT_POINTS:
-                return path, pos, cost
-            
-            # Explore neighbors (only roads, no parking spaces)
-            for neighbor in self.get_neighbors(pos):
-                new_cost = cost + self.road_weights[neighbor[0]][neighbor[1]]
-                
-                if neighbor not in visited or new_cost < visited[neighbor]:
-                    visited[neighbor] = new_cost
-                    new_path = path + [neighbor]
-                    heapq.heappush(pq, (new_cost, neighbor, new_path))
+        Exits in exclude are passed through but never returned; limit stops
+        the search after that many exits (limit=1 gives the nearest exit
+        other than the excluded ones). Returns a list of (path, exit_point,
+        cost), without the exits that cannot be reached.
+        """
+        exclude = set(exclude)
+        wanted = [pos for pos in self.layout.exit_points if pos not in exclude]
+        if limit is not None:
+            limit = min(limit, len(wanted))
+        size = self.graph.size
         
-        return None, None, float('inf')
+        def exit_at(node):
+            pos = divmod(node, size)
+            return [] if pos in exclude else [pos]
+        
+        return self.pathfinder.search_many(start_pos, self.exit_mask, exit_at,
+                                           len(wanted) if limit is None else limit)
+    
+    def enable_route_cache(self, max_size=1024, tolerance=0.0, audit_every=0):
+        """Start caching parking and exit routes (see RouteCache); returns the cache"""
+        self.route_cache = RouteCache(self, max_size, tolerance, audit_every)
+        return self.route_cache
     
     def reserve_parking(self, parking_pos):
         """Reserve a parking space"""
-        if parking_pos in self.parking_status:
-            self.parking_status[parking_pos] = 'reserved'
+        self._set_parking_status(parking_pos, 'reserved')
     
     def occupy_parking(self, parking_pos):
         """Occupy a parking space"""
-        if parking_pos in self.parking_status:
-            self.parking_status[parking_pos] = 'occupied'
+        self._set_parking_status(parking_pos, 'occupied')
     
     def free_parking(self, parking_pos):
         """Free a parking space"""
-        if parking_pos in self.parking_status:
-            self.parking_status[parking_pos] = 'empty'
+        self._set_parking_status(parking_pos, 'empty')
+    
+    def path_road_nodes(self, path):
+        """Flat indices of the road cells on a path, as an array"""
+        size = self.graph.size
+        nodes = np.array([row * size + col for row, col in path], dtype=np.intp)
+        return nodes[self.cells_flat[nodes] == CELL_ROAD]
     
     def update_path_weights(self, path, increment=1.5):
         """Update road weights after path is chosen"""
-        for pos in path:
-            if self.grid[pos[0]][pos[1]] == 'road':
-                self.road_weights[pos[0]][pos[1]] += increment
+        # np.add.at applies every occurrence, so a path that revisits a cell adds twice
+        nodes = self.path_road_nodes(path)
+        self.exit_field.mark_dirty_many(nodes, self.weights_flat[nodes])
+        np.add.at(self.weights_flat, nodes, increment)
+        self.weight_epoch += 1
     
     def release_path_weights(self, path, decrement=1.5):
         """Release road weights when path is abandoned"""
-        for pos in path:
-            if self.grid[pos[0]][pos[1]] == 'road':
-                self.road_weights[pos[0]][pos[1]] -= decrement
-                self.road_weights[pos[0]][pos[1]] = max(1.0, self.road_weights[pos[0]][pos[1]])
+        nodes = self.path_road_nodes(path)
+        self.exit_field.mark_dirty_many(nodes, self.weights_flat[nodes])
+        # Clamping once after all the subtractions equals clamping after each one
+        np.subtract.at(self.weights_flat, nodes, decrement)
+        self.weights_flat[nodes] = np.maximum(self.weights_flat[nodes], self.MIN_WEIGHT)
+        self.weight_epoch += 1
     
     def increment_segment(self, pos, increment=10.5):
         """Increment road segment when car enters"""
-        if self.grid[pos[0]][pos[1]] == 'road':
-            self.road_weights[pos[0]][pos[1]] += increment
+        node = pos[0] * self.graph.size + pos[1]
+        if self.graph.is_road[node]:
+            weight = self.weights_flat.item(node)
+            self.exit_field.mark_dirty(node, weight)
+            self.weights_flat[node] = weight + increment
+            self.weight_epoch += 1
     
     def decrement_segment(self, pos, decrement=12):
         """Decrement road segment when car leaves"""
-        if self.grid[pos[0]][pos[1]] == 'road':
-            self.road_weights[pos[0]][pos[1]] -= decrement
+        node = pos[0] * self.graph.size + pos[1]
+        if self.graph.is_road[node]:
+            weight = self.weights_flat.item(node)
+            self.exit_field.mark_dirty(node, weight)
             # Ensure weight doesn't go below 1
-            self.road_weights[pos[0]][pos[1]] = max(1.0, self.road_weights[pos[0]][pos[1]])
+            self.weights_flat[node] = max(self.MIN_WEIGHT, weight - decrement)
+            self.weight_epoch += 1
+
+
+class CarStore:
+    """Struct-of-arrays storage for the kinematic state of a fleet of cars.
+
+    Slot ``i`` holds one car's pixel position (``x``, ``y``), the pixel centre
+    of the grid cell it is driving to (``target_x``, ``target_y``), its speed,
+    its state code and whether it is in motion. ``advance`` moves every car
+    in motion in one vectorized step and returns the cars that reached their
+    target cell, whose grid bookkeeping then runs per car in Car.arrive.
+    """
+    STATE_CODES = {'entering': 0, 'parked': 1, 'exiting': 2, 'waiting': 3, 'exited': 4}
+    
+    def __init__(self, capacity=64):
+        self.capacity = 0
+        self.cars = []
+        self.free_slots = []
+        self.x = np.zeros(0)
+        self.y = np.zeros(0)
+        self.target_x = np.zeros(0)
+        self.target_y = np.zeros(0)
+        self.speed = np.zeros(0)
+        self.state = np.zeros(0, dtype=np.int8)
+        self.moving = np.zeros(0, dtype=bool)
+        self._grow(capacity)
+    
+    def _grow(self, capacity):
+        """Enlarge every array to the given number of slots"""
+        extra = capacity - self.capacity
+        self.x = np.concatenate([self.x, np.zeros(extra)])
+        self.y = np.concatenate([self.y, np.zeros(extra)])
+        self.target_x = np.concatenate([self.target_x, np.zeros(extra)])
+        self.target_y = np.concatenate([self.target_y, np.zeros(extra)])
+        self.speed = np.concatenate([self.speed, np.zeros(extra)])
+        self.state = np.concatenate([self.state, np.full(extra, -1, dtype=np.int8)])
+        self.moving = np.concatenate([self.moving, np.zeros(extra, dtype=bool)])
+        self.cars.extend([None] * extra)
+        # Hand out low slots first so live cars stay packed at the front
+        self.free_slots.extend(range(capacity - 1, self.capacity - 1, -1))
+        self.capacity = capacity
+    
+    def __len__(self):
+        return self.capacity - len(self.free_slots)
+    
+    def add(self, car, x, y, speed):
+        """Give a car a slot and return it"""
+        if not self.free_slots:
+            self._grow(max(1, self.capacity * 2))
+        slot = self.free_slots.pop()
+        self.cars[slot] = car
+        self.x[slot] = x
+        self.y[slot] = y
+        self.speed[slot] = speed
+        self.moving[slot] = False
+        return slot
+    
+    def remove(self, car):
+        """Release a car's slot"""
+        slot = car.slot
+        self.cars[slot] = None
+        self.moving[slot] = False
+        self.state[slot] = -1
+        self.free_slots.append(slot)
+    
+    def sync(self, car):
+        """Copy a car's state and next target cell into its slot"""
+        slot = car.slot
+        state = car.state
+        self.state[slot] = self.STATE_CODES[state]
+        if (state == 'entering' or state == 'exiting') and car.current_path_index < len(car.path):
+            row, col = car.path[car.current_path_index]
+            self.target_x[slot] = col * CELL_SIZE + CELL_SIZE // 2
+            self.target_y[slot] = row * CELL_SIZE + CELL_SIZE // 2
+            self.moving[slot] = True
+        else:
+            self.moving[slot] = False
+    
+    def advance(self):
+        """Move all cars in motion one tick; return those that reached their target"""
+        slots = np.flatnonzero(self.moving)
+        if not len(slots):
+            return []
+        dx = self.target_x[slots] - self.x[slots]
+        dy = self.target_y[slots] - self.y[slots]
+        distance = np.sqrt(dx * dx + dy * dy)
+        speed = self.speed[slots]
+        
+        arrived = distance < speed
+        going = ~arrived
+        moving_slots = slots[going]
+        self.x[moving_slots] += (dx[going] / distance[going]) * speed[going]
+        self.y[moving_slots] += (dy[going] / distance[going]) * speed[going]
+        
+        # Cars that reach the cell centre snap onto it
+        arrived_slots = slots[arrived]
+        self.x[arrived_slots] = self.target_x[arrived_slots]
+        self.y[arrived_slots] = self.target_y[arrived_slots]
+        cars = self.cars
+        return [cars[slot] for slot in arrived_slots.tolist()]
 
 
 class Car:
-    def __init__(self, car_id, entry_point, path, destination, parking_lot, is_exiting=False):
+    # Slotted: no per-car __dict__, and cars are recycled through CarPool
+    __slots__ = ('id', 'path', 'destination', 'current_path_index', 'position', 'parking_lot',
+                 'move_speed', 'store', 'slot', 'index', '_visual_position', '_state',
+                 'parking_duration', 'parked_timer', 'is_exiting', 'waiting_timer',
+                 'target_segment', 'in_deadlock', 'original_path', 'original_destination', 'wait_graph',
+                 'counters')
+    
+    def __init__(self, car_id, entry_point, path, destination, parking_lot, is_exiting=False, store=None,
+                 wait_graph=None, counters=None, *, parking_duration):
+        self.reset(car_id, entry_point, path, destination, parking_lot, is_exiting, store, wait_graph, counters,
+                   parking_duration=parking_duration)
+    
+    def reset(self, car_id, entry_point, path, destination, parking_lot, is_exiting=False, store=None,
+              wait_graph=None, counters=None, *, parking_duration):
+        """(Re)initialise the car for a new trip through the lot.
+        
+        parking_duration (ticks) is required: callers draw it from their
+        engine's seeded RNG, so no car depends on the global random module.
+        """
         self.id = car_id
         self.path = path
         self.destination = destination  # parking spot or exit point
         self.current_path_index = 0
         self.position = entry_point  # Grid position (row, col)
-        self.visual_position = [entry_point[1] * CELL_SIZE + CELL_SIZE // 2, 
-                               entry_point[0] * CELL_SIZE + CELL_SIZE // 2]  # [x, y] for smooth rendering
         self.parking_lot = parking_lot
-        self.state = 'entering' if not is_exiting else 'exiting'  # 'entering', 'parked', 'exiting', 'waiting'
-        self.parking_duration = random.randint(300, 900)  # 5-15 seconds at 60fps
+        self.move_speed = 2.0  # Pixels per frame for smooth movement
+        # Without a CarStore the car keeps its own [x, y]; with one, the store does
+        self.store = store
+        self.wait_graph = wait_graph  # WaitForGraph told about waiting/unblocked transitions
+        self.counters = counters  # CarCounters told about every state transition
+        self.slot = None
+        self.index = None  # Position in SimulationEngine.cars
+        self._visual_position = None
+        visual_position = [entry_point[1] * CELL_SIZE + CELL_SIZE // 2, 
+                           entry_point[0] * CELL_SIZE + CELL_SIZE // 2]  # [x, y] for smooth rendering
+        if store is not None:
+            self.slot = store.add(self, visual_position[0], visual_position[1], self.move_speed)
+        else:
+            self._visual_position = visual_position
+        self._state = 'entering' if not is_exiting else 'exiting'  # 'entering', 'parked', 'exiting', 'waiting'
+        self.parking_duration = parking_duration
         self.parked_timer = 0
         self.is_exiting = is_exiting
+        if counters is not None:
+            counters.add(self._state, is_exiting)
         self.waiting_timer = 0
         self.target_segment = None
-        self.move_speed = 2.0  # Pixels per frame for smooth movement
         self.in_deadlock = False
         self.original_path = None
         self.original_destination = None
@@ -221,7 +1097,56 @@ class Car:
             self.parking_lot.occupy_road(self.position, self.id)
             if len(self.path) > 1:
                 self.target_segment = self.path[1]
-        
+        self.refresh_motion()
+    
+    def clear(self):
+        """Drop references to the lot and routes so a pooled car holds nothing alive"""
+        self.path = None
+        self.original_path = None
+        self.parking_lot = None
+        self.store = None
+        self.wait_graph = None
+        self.counters = None
+        self.slot = None
+        self.index = None
+        self.target_segment = None
+    
+    @property
+    def visual_position(self):
+        """[x, y] pixel position for smooth rendering"""
+        if self.store is None:
+            return self._visual_position
+        return [self.store.x.item(self.slot), self.store.y.item(self.slot)]
+    
+    @visual_position.setter
+    def visual_position(self, value):
+        if self.store is None:
+            self._visual_position = value
+        else:
+            self.store.x[self.slot], self.store.y[self.slot] = value
+    
+    @property
+    def state(self):
+        """'entering', 'parked', 'exiting', 'waiting' or 'exited'"""
+        return self._state
+    
+    @state.setter
+    def state(self, value):
+        if self.wait_graph is not None:
+            if value == 'waiting':
+                self.wait_graph.add(self)
+            elif self._state == 'waiting':
+                self.wait_graph.remove(self)
+        if self.counters is not None:
+            self.counters.move(self._state, value, self.is_exiting)
+        self._state = value
+        self.refresh_motion()
+    
+    def refresh_motion(self):
+        """Push the car's state and next target cell to its CarStore, if any"""
+        if self.store is not None:
+            self.store.sync(self)
+    
     def update(self):
         """Update car position with smooth movement"""
         if self.state == 'parked':
@@ -244,50 +1169,56 @@ class Car:
             target_grid_pos = self.path[self.current_path_index]
             target_visual_x = target_grid_pos[1] * CELL_SIZE + CELL_SIZE // 2
             target_visual_y = target_grid_pos[0] * CELL_SIZE + CELL_SIZE // 2
+            visual_x, visual_y = self.visual_position
             
             # Calculate distance
-            dx = target_visual_x - self.visual_position[0]
-            dy = target_visual_y - self.visual_position[1]
+            dx = target_visual_x - visual_x
+            dy = target_visual_y - visual_y
             distance = (dx**2 + dy**2)**0.5
             
             if distance < self.move_speed:
                 # Reached target grid position
-                self.visual_position[0] = target_visual_x
-                self.visual_position[1] = target_visual_y
-                
-                # Free previous road segment
-                self.parking_lot.free_road(self.position)
-                self.parking_lot.decrement_segment(self.position, 12 if not self.in_deadlock else 24)
-                
-                # Update grid position
-                self.position = target_grid_pos
-                self.current_path_index += 1
-                
-                # Check if we have more segments to traverse
-                if self.current_path_index < len(self.path):
-                    self.target_segment = self.path[self.current_path_index]
-                    
-                    # Check if next segment is occupied
-                    if self.parking_lot.is_road_occupied(self.target_segment):
-                        self.state = 'waiting'
-                        self.parking_lot.occupy_road(self.position, self.id)
-                        self.parking_lot.increment_segment(self.position, 10.5 if not self.in_deadlock else 21)
-                    else:
-                        # Occupy current segment
-                        self.parking_lot.occupy_road(self.position, self.id)
-                        self.parking_lot.increment_segment(self.position, 10.5 if not self.in_deadlock else 21)
-                else:
-                    # Reached final destination
-                    self.reach_destination()
+                self.visual_position = [target_visual_x, target_visual_y]
+                self.arrive()
             else:
                 # Move towards target
-                self.visual_position[0] += (dx / distance) * self.move_speed
-                self.visual_position[1] += (dy / distance) * self.move_speed
+                self.visual_position = [visual_x + (dx / distance) * self.move_speed,
+                                        visual_y + (dy / distance) * self.move_speed]
         else:
             # Path completed
             if self.state != 'parked':
                 self.reach_destination()
     
+    def arrive(self):
+        """Grid bookkeeping once the car reaches the centre of its next path cell"""
+        target_grid_pos = self.path[self.current_path_index]
+        
+        # Free previous road segment
+        self.parking_lot.free_road(self.position)
+        self.parking_lot.decrement_segment(self.position, 12 if not self.in_deadlock else 24)
+        
+        # Update grid position
+        self.position = target_grid_pos
+        self.current_path_index += 1
+        
+        # Check if we have more segments to traverse
+        if self.current_path_index < len(self.path):
+            self.target_segment = self.path[self.current_path_index]
+            
+            # Check if next segment is occupied
+            if self.parking_lot.is_road_occupied(self.target_segment):
+                self.state = 'waiting'
+                self.parking_lot.occupy_road(self.position, self.id)
+                self.parking_lot.increment_segment(self.position, 10.5 if not self.in_deadlock else 21)
+            else:
+                # Occupy current segment
+                self.parking_lot.occupy_road(self.position, self.id)
+                self.parking_lot.increment_segment(self.position, 10.5 if not self.in_deadlock else 21)
+                self.refresh_motion()
+        else:
+            # Reached final destination
+            self.reach_destination()
+    
     def reach_destination(self):
         """Handle reaching the destination"""
         if self.is_exiting:
@@ -296,10 +1227,10 @@ class Car:
         else:
             # Car parks
             self.parking_lot.occupy_parking(self.destination)
-            self.state = 'parked'
             self.position = self.destination
             self.visual_position = [self.destination[1] * CELL_SIZE + CELL_SIZE // 2,
                                    self.destination[0] * CELL_SIZE + CELL_SIZE // 2]
+            self.state = 'parked'
     
     def start_exit(self):
         """Start the exit process"""
@@ -309,17 +1240,8 @@ class Car:
         if not adjacent_roads:
             return
         
-        # Find best exit path from adjacent roads
-        best_path = None
-        best_exit = None
-        best_cost = float('inf')
-        
-        for road_pos in adjacent_roads:
-            path, exit_point, cost = self.parking_lot.find_shortest_path_to_exit(road_pos)
-            if path and cost < best_cost:
-                best_path = path
-                best_exit = exit_point
-                best_cost = cost
+        # Find best exit path from adjacent roads (one multi-source search)
+        best_path, best_exit, best_cost = self.parking_lot.find_shortest_path_to_exit_from(adjacent_roads)
         
         if best_path and best_exit:
             # Free parking space
@@ -344,38 +1266,442 @@ class Car:
             self.parking_lot.increment_segment(self.position, 10.5)
 
 
-class Simulation:
-    def __init__(self, cars_per_minute):
-        pygame.init()
-        self.screen = pygame.display.set_mode((WINDOW_WIDTH, WINDOW_HEIGHT))
-        pygame.display.set_caption("Parking Lot Simulation")
-        self.clock = pygame.time.Clock()
-        self.font = pygame.font.Font(None, 20)
-        self.small_font = pygame.font.Font(None, 16)
+class WaitForGraph:
+    """Wait-for graph of waiting cars, updated as cars start and stop waiting.
+
+    A waiting car depends on whichever car occupies its target segment, and
+    the edge only counts while that car is waiting too. Each car waits on one
+    segment, so every deadlock is a simple cycle, and a new one must pass
+    through a car that started waiting since the last check: find_cycles only
+    walks forward from those cars.
+    """
+    def __init__(self, parking_lot):
+        self.parking_lot = parking_lot
+        self.dependencies = {}  # Waiting car id -> segment it waits for
+        self.waiters = {}  # Segment -> ids of the cars waiting for it
+        self.changed = []  # Cars that started waiting since the last find_cycles
+        self.cycle_of = {}  # Car id -> the reported cycle it belongs to
+    
+    def add(self, car):
+        """Record that a car started waiting for its target segment"""
+        if car.id in self.dependencies:
+            self.remove(car)
+        self.dependencies[car.id] = car.target_segment
+        self.waiters.setdefault(car.target_segment, set()).add(car.id)
+        self.changed.append(car.id)
+    
+    def remove(self, car):
+        """Record that a car stopped waiting; a cycle it was in is broken"""
+        segment = self.dependencies.pop(car.id, None)
+        waiters = self.waiters.get(segment)
+        if waiters:
+            waiters.discard(car.id)
+            if not waiters:
+                del self.waiters[segment]
+        cycle = self.cycle_of.pop(car.id, None)
+        if cycle:
+            for car_id in cycle:
+                self.cycle_of.pop(car_id, None)
+    
+    def is_deadlocked(self, cycle):
+        """Whether a reported cycle (the list find_cycles returned) is still intact.
         
-        self.parking_lot = ParkingLot()
+        Compared by identity: if the cycle breaks and re-forms with the same
+        cars, the new one is a new list and the old report no longer counts.
+        """
+        return self.cycle_of.get(cycle[0]) is cycle
+    
+    def find_cycles(self):
+        """Return every new cycle (list of car ids) closed since the last call"""
+        dependencies = self.dependencies
+        occupancy = self.parking_lot.road_occupancy
+        known = self.cycle_of
+        cycles = []
+        visited = set()
+        for start in self.changed:
+            if start not in dependencies or start in visited:
+                continue
+            walk = {}  # Car id -> position along this walk
+            order = []
+            car_id = start
+            while car_id is not None and car_id not in visited and car_id not in known:
+                visited.add(car_id)
+                walk[car_id] = len(order)
+                order.append(car_id)
+                blocking_car_id = occupancy.get(dependencies[car_id])
+                car_id = blocking_car_id if blocking_car_id in dependencies else None
+            if car_id in walk:
+                cycle = order[walk[car_id]:]
+                for member in cycle:
+                    known[member] = cycle
+                cycles.append(cycle)
+        self.changed.clear()
+        return cycles
+
+
+class EventScheduler:
+    """Wake-up times for cars that are neither moving nor due any work.
+
+    Parked cars sleep until their departure tick; waiting cars are woken
+    for the next tick when their target segment is freed (see
+    SimulationEngine.wake_waiters), so idle cars cost nothing per tick.
+    """
+    def __init__(self):
+        self.departures = []  # Heap of (tick, car id)
+        self.wakes = set()  # Car ids to run on the next tick
+        self.waiting_since = {}  # Car id -> tick it started waiting
+    
+    def schedule(self, tick, car_id):
+        """Run a car's update on the given tick"""
+        heapq.heappush(self.departures, (tick, car_id))
+    
+    def wake(self, car_id):
+        """Run a car's update on the next tick"""
+        self.wakes.add(car_id)
+    
+    def due(self, tick):
+        """Pop the ids of every car with an event at or before tick"""
+        departures = self.departures
+        car_ids = self.wakes
+        self.wakes = set()
+        while departures and departures[0][0] <= tick:
+            car_ids.add(heapq.heappop(departures)[1])
+        return car_ids
+
+
+class CarCounters:
+    """Running count of cars per state, updated on every Car state transition.
+
+    Waiting cars are counted per direction (is_exiting), so the entering and
+    exiting totals shown in the stats panel include the cars waiting on the
+    way in or out. 'exited' only ever grows: it is the number of cars that
+    have left the lot.
+
+    ``car_ticks`` integrates the counts over time (one ``advance`` per tick)
+    and ``transitions`` counts the cars that ever entered each state, which
+    is enough for mean times per state without timing cars one by one.
+    """
+    def __init__(self):
+        self.counts = defaultdict(int)
+        self.car_ticks = defaultdict(int)
+        self.transitions = defaultdict(int)
+    
+    @staticmethod
+    def key(state, is_exiting):
+        return ('waiting', is_exiting) if state == 'waiting' else state
+    
+    def add(self, state, is_exiting):
+        """Count a new car"""
+        self.counts[self.key(state, is_exiting)] += 1
+    
+    def move(self, old_state, new_state, is_exiting):
+        """Move a car from one state's count to another's"""
+        counts = self.counts
+        counts[self.key(old_state, is_exiting)] -= 1
+        new_key = self.key(new_state, is_exiting)
+        counts[new_key] += 1
+        self.transitions[new_key] += 1
+    
+    def advance(self):
+        """Add one tick of every current count to car_ticks"""
+        car_ticks = self.car_ticks
+        for key, count in self.counts.items():
+            car_ticks[key] += count
+    
+    def snapshot(self):
+        """Car counts as shown in the stats panel"""
+        counts = self.counts
+        waiting_in, waiting_out = counts[('waiting', False)], counts[('waiting', True)]
+        return {
+            'entering': counts['entering'] + waiting_in,
+            'parked': counts['parked'],
+            'exiting': counts['exiting'] + waiting_out,
+            'waiting': waiting_in + waiting_out,
+            'exited': counts['exited'],
+        }
+
+
+class CarPool:
+    """Free list of exited cars that spawn recycles instead of allocating new ones"""
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self.free = []
+        self.created = 0
+        self.reused = 0
+    
+    def acquire(self, car_id, entry_point, path, destination, parking_lot, is_exiting=False, store=None,
+                wait_graph=None, counters=None, *, parking_duration):
+        """Return a car set up for a new trip, recycled when one is available"""
+        if self.free:
+            car = self.free.pop()
+            car.reset(car_id, entry_point, path, destination, parking_lot, is_exiting, store, wait_graph,
+                      counters, parking_duration=parking_duration)
+            self.reused += 1
+            return car
+        self.created += 1
+        return Car(car_id, entry_point, path, destination, parking_lot, is_exiting, store, wait_graph, counters,
+                   parking_duration=parking_duration)
+    
+    def release(self, car):
+        """Take back an exited car"""
+        car.clear()
+        if len(self.free) < self.max_size:
+            self.free.append(car)
+
+
+class Profiler:
+    """Opt-in per-phase timings and counters over a rolling window of frames.
+
+    Phases are timed with ``lap``; a phase may run several times per frame
+    and its times add up. Tracked counters are sampled once per frame, as
+    the change since the previous frame (e.g. nodes expanded by searches)
+    or as a level (e.g. cars on the lot). Only the last ``window`` frames
+    are kept, so memory stays bounded on long runs.
+    """
+    def __init__(self, window=600):
+        self.window = window
+        self.frames = 0
+        self.timings = {}  # phase -> deque of seconds per frame
+        self.calls = defaultdict(int)  # phase -> calls over the whole run
+        self.samples = {}  # counter -> deque of values per frame
+        self.tracked = []  # (counter, getter, per-frame delta?)
+        self.last_totals = {}
+        self.frame_times = defaultdict(float)
+    
+    def lap(self, phase, started):
+        """Charge the time since started to phase and return the current time"""
+        now = time.perf_counter()
+        self.frame_times[phase] += now - started
+        self.calls[phase] += 1
+        return now
+    
+    def track(self, name, getter, delta=True):
+        """Sample getter() every frame, as the change since last frame or as a level"""
+        self.tracked.append((name, getter, delta))
+        self.last_totals[name] = getter()
+    
+    def end_frame(self):
+        """Close the current frame and push its totals into the rolling window"""
+        for phase, seconds in self.frame_times.items():
+            if phase not in self.timings:
+                self.timings[phase] = deque([0.0] * min(self.frames, self.window), maxlen=self.window)
+        for phase, history in self.timings.items():
+            history.append(self.frame_times.get(phase, 0.0))
+        for name, getter, delta in self.tracked:
+            value = getter()
+            if delta:
+                value, self.last_totals[name] = value - self.last_totals[name], value
+            self.samples.setdefault(name, deque(maxlen=self.window)).append(value)
+        self.frame_times.clear()
+        self.frames += 1
+    
+    def summary(self):
+        """Per-phase milliseconds per frame (mean, p50, p95, max) and mean counter values"""
+        phases = {}
+        for phase, history in self.timings.items():
+            ms = np.array(history) * 1000
+            phases[phase] = {'calls': self.calls[phase], 'mean_ms': float(ms.mean()),
+                             'p50_ms': float(np.percentile(ms, 50)), 'p95_ms': float(np.percentile(ms, 95)),
+                             'max_ms': float(ms.max())}
+        counters = {name: float(np.mean(values)) for name, values in self.samples.items() if values}
+        return {'frames': self.frames, 'window': self.window, 'phases': phases, 'counters': counters}
+    
+    def histogram(self, phase, bins=10):
+        """Counts and bin edges (ms) of the phase's frame times in the window"""
+        counts, edges = np.histogram(np.array(self.timings[phase]) * 1000, bins=bins)
+        return counts.tolist(), edges.tolist()
+    
+    def lines(self):
+        """Short text report, one line per phase and counter (for the overlay)"""
+        summary = self.summary()
+        lines = [f"{phase:<16}{stats['mean_ms']:7.2f}{stats['p95_ms']:7.2f} ms"
+                 for phase, stats in summary['phases'].items()]
+        lines += [f"{name:<16}{value:9.1f} /frame" for name, value in summary['counters'].items()]
+        return lines
+    
+    def dump(self, path):
+        """Write the summary and a histogram per phase to a JSON file"""
+        report = self.summary()
+        for phase in self.timings:
+            counts, edges = self.histogram(phase)
+            report['phases'][phase]['histogram'] = {'counts': counts, 'edges_ms': edges}
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+class ArrivalLog:
+    """Cars arriving at the gates, as (tick, entry point, parking duration) in arrival order.
+
+    An arrival is logged whether or not the car could be let in, so a log
+    recorded from one engine replays the same workload on any other.
+    """
+    def __init__(self, arrivals=None):
+        self.arrivals = [(tick, tuple(entry_point), duration) for tick, entry_point, duration in arrivals or []]
+    
+    def __len__(self):
+        return len(self.arrivals)
+    
+    def record(self, tick, entry_point, parking_duration):
+        """Append one arrival"""
+        self.arrivals.append((tick, entry_point, parking_duration))
+    
+    def save(self, path):
+        """Write the log as JSON"""
+        with open(path, 'w') as f:
+            json.dump({'arrivals': [[tick, row, col, duration] for tick, (row, col), duration in self.arrivals]}, f)
+    
+    @classmethod
+    def load(cls, path):
+        """Read a log written by save"""
+        with open(path) as f:
+            rows = json.load(f)['arrivals']
+        return cls((tick, (row, col), duration) for tick, row, col, duration in rows)
+
+
+class TelemetrySink:
+    """Buffered writer of telemetry records to a file path or an open text file.
+
+    Records are formatted as they arrive and written out ``buffer_size`` at
+    a time, so memory stays bounded however long the run. Subclasses
+    define ``format(record)``, which returns one line.
+    """
+    def __init__(self, target, buffer_size=1000):
+        self.owns_file = not hasattr(target, 'write')
+        self.file = open(target, 'w', newline='') if self.owns_file else target
+        self.buffer_size = buffer_size
+        self.buffer = []
+        self.records = 0
+    
+    def write(self, record):
+        """Queue one record, writing the buffer out once it is full"""
+        self.buffer.append(self.format(record))
+        self.records += 1
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+    
+    def write_all(self, records):
+        """Write every record from an iterable (e.g. SimulationEngine.telemetry); returns the count"""
+        count = 0
+        for record in records:
+            self.write(record)
+            count += 1
+        return count
+    
+    def flush(self):
+        """Write out the buffered records"""
+        if self.buffer:
+            self.file.write(''.join(self.buffer))
+            self.buffer.clear()
+        self.file.flush()
+    
+    def close(self):
+        """Flush, and close the file if the sink opened it"""
+        self.flush()
+        if self.owns_file:
+            self.file.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class NDJSONSink(TelemetrySink):
+    """One JSON object per line"""
+    def format(self, record):
+        return json.dumps(record) + '\n'
+
+
+class CSVSink(TelemetrySink):
+    """Comma-separated values with a header row taken from the first record"""
+    def __init__(self, target, buffer_size=1000):
+        super().__init__(target, buffer_size)
+        self.fields = None
+    
+    def format(self, record):
+        line = ','.join(str(record[field]) for field in (self.fields or record)) + '\n'
+        if self.fields is None:
+            self.fields = list(record)
+            line = ','.join(self.fields) + '\n' + line
+        return line
+
+
+def open_telemetry_sink(path, buffer_size=1000):
+    """CSVSink for a .csv path, NDJSONSink for anything else"""
+    sink = CSVSink if str(path).lower().endswith('.csv') else NDJSONSink
+    return sink(path, buffer_size)
+
+
+class SimulationEngine:
+    """Headless simulation core: spawning, car updates and deadlock handling.
+
+    One tick is one frame of lot time (1/60 s). Nothing here touches pygame,
+    so ``step``/``run_until`` run as fast as the CPU allows.
+
+    Gates and parking durations are drawn from ``self.rng``, seeded with
+    ``seed`` (or from the global ``random`` module when no seed is given).
+    With ``record`` every arrival is appended to ``arrival_log``; with
+    ``replay`` (an ArrivalLog) cars arrive exactly as logged instead, and
+    ``cars_per_minute`` is ignored.
+    """
+    def __init__(self, cars_per_minute, layout=None, seed=None, record=False, replay=None, parking_status=None):
+        self.seed = seed if seed is not None else random.getrandbits(64)
+        self.rng = random.Random(self.seed)
+        self.arrival_log = ArrivalLog() if record else None
+        self.replay = replay
+        self.replay_index = 0  # Next arrival in replay.arrivals
+        self.parking_lot = ParkingLot(layout, parking_status=parking_status)
+        self.layout = self.parking_lot.layout
         self.cars = []
+        self.cars_by_id = {}  # id -> Car, for resolving road_occupancy entries
+        self.store = CarStore()
+        self.pool = CarPool()
         self.car_counter = 0
         self.cars_per_minute = cars_per_minute
         self.spawn_rate = 60 / cars_per_minute if cars_per_minute > 0 else float('inf')
         self.spawn_timer = 0
-        self.running = True
-        self.deadlock_check_timer = 0
+        self.wait_graph = WaitForGraph(self.parking_lot)
+        self.counters = CarCounters()
+        self.pending_deadlocks = deque()  # (tick to resolve at, cycle of car ids), in the order found
+        self.scheduler = EventScheduler()
+        self.parking_lot.on_road_freed = self.wake_waiters
+        self._running = None  # (heap, queued ids, current id) while update_cars runs
+        self.profiler = None  # Profiler, once enable_profiling is called
+        self.tick_ends_frame = True  # Headless, each tick is one profiler frame
         self.total_deadlocks_resolved = 0
+        self.spawn_rejects = 0  # Arrivals turned away: lot full, gate blocked or no route
+        self.tick_count = 0
+    
+    def enable_profiling(self, window=600):
+        """Start timing each tick phase and sampling search counters; returns the Profiler"""
+        profiler = Profiler(window)
+        lot = self.parking_lot
+        profiler.track('searches', lambda: lot.pathfinder.search_count)
+        profiler.track('nodes_expanded', lambda: lot.pathfinder.total_expanded)
+        profiler.track('exit_repairs', lambda: lot.exit_field.repairs + lot.exit_field.rebuilds)
+        profiler.track('cars', lambda: len(self.cars), delta=False)
+        self.profiler = profiler
+        return profiler
+        
+    def spawn_car(self, entry_point=None, parking_duration=None):
+        """Spawn a new car at a fixed entry point (random gate and duration unless given)"""
+        # Choose random entry point from fixed entry points
+        if entry_point is None:
+            entry_point = self.rng.choice(self.layout.entry_points)
+        if parking_duration is None:
+            parking_duration = self.rng.randint(300, 900)  # 5-15 seconds at 60fps
+        if self.arrival_log is not None:
+            self.arrival_log.record(self.tick_count, entry_point, parking_duration)
         
-    def spawn_car(self):
-        """Spawn a new car at a fixed entry point"""
         # Check if there are empty parking spaces
-        empty_spaces = [pos for pos, status in self.parking_lot.parking_status.items() 
-                       if status == 'empty']
-        if not empty_spaces:
+        if not self.parking_lot.has_empty_parking():
+            self.spawn_rejects += 1
             return
         
-        # Choose random entry point from fixed entry points
-        entry_point = random.choice(ENTRY_POINTS)
-        
         # Check if entry point is occupied
         if self.parking_lot.is_road_occupied(entry_point):
+            self.spawn_rejects += 1
             return
         
         # Find shortest path to parking
@@ -389,57 +1715,18 @@ class Simulation:
             self.parking_lot.update_path_weights(path, 1.5)
             
             # Create car
-            car = Car(self.car_counter, entry_point, path, parking_spot, self.parking_lot, is_exiting=False)
-            self.cars.append(car)
+            car = self.pool.acquire(self.car_counter, entry_point, path, parking_spot, self.parking_lot,
+                                    is_exiting=False, store=self.store, wait_graph=self.wait_graph,
+                                    counters=self.counters, parking_duration=parking_duration)
+            self.add_car(car)
             self.car_counter += 1
+        else:
+            self.spawn_rejects += 1
     
     def detect_deadlock(self):
-        """Detect if there's a deadlock among waiting cars"""
-        waiting_cars = [car for car in self.cars if car.state == 'waiting' and car.waiting_timer > DEADLOCK_THRESHOLD]
-        
-        if len(waiting_cars) < 2:
-            return []
-        
-        # Build dependency graph: car -> car it's waiting for
-        dependencies = {}
-        for car in waiting_cars:
-            if car.target_segment:
-                blocking_car_id = self.parking_lot.road_occupancy.get(car.target_segment)
-                if blocking_car_id is not None:
-                    blocking_car = next((c for c in self.cars if c.id == blocking_car_id), None)
-                    if blocking_car and blocking_car.state == 'waiting':
-                        dependencies[car.id] = blocking_car.id
-        
-        # Detect cycles using DFS
-        def has_cycle(car_id, visited, rec_stack):
-            visited.add(car_id)
-            rec_stack.add(car_id)
-            
-            if car_id in dependencies:
-                neighbor = dependencies[car_id]
-                if neighbor not in visited:
-                    if has_cycle(neighbor, visited, rec_stack):
-                        return True
-                elif neighbor in rec_stack:
-                    return True
-            
-            rec_stack.remove(car_id)
-            return False
-        
-        # Find all cars in deadlock
-        deadlocked_cars = []
-        visited = set()
-        
-        for car in waiting_cars:
-            if car.id not in visited:
-                rec_stack = set()
-                if has_cycle(car.id, visited, rec_stack):
-                    # Find all cars in the cycle
-                    cycle_cars = [c for c in waiting_cars if c.id in visited]
-                    deadlocked_cars.extend(cycle_cars)
-                    break
-        
-        return deadlocked_cars
+        """Return the deadlocks (each a list of cars in one cycle) formed since the last call"""
+        cars_by_id = self.cars_by_id
+        return [[cars_by_id[car_id] for car_id in cycle] for cycle in self.wait_graph.find_cycles()]
     
     def count_empty_neighbors(self, car):
         """Count how many empty road segments are accessible from car's position"""
@@ -457,7 +1744,7 @@ class Simulation:
         
         for car in deadlocked_cars:
             # Store original path and destination
-            car.original_path = car.path.copy()
+            car.original_path = car.path  # Paths are replaced, never mutated
             car.original_destination = car.destination
             
             # Release old path weights
@@ -466,19 +1753,12 @@ class Simulation:
             
             # Find new destination
             if car.is_exiting:
-                # Find next closest exit
+                # Find next closest exit, avoiding the one the car was stuck heading for
                 best_path = None
                 best_exit = None
-                best_cost = float('inf')
-                
-                for exit_point in EXIT_POINTS:
-                    if exit_point == car.original_destination:
-                        continue
-                    path, exit_pt, cost = self.parking_lot.find_shortest_path_to_exit(car.position)
-                    if path and exit_pt == exit_point and cost < best_cost:
-                        best_path = path
-                        best_exit = exit_point
-                        best_cost = cost
+                ranked = self.parking_lot.rank_exit_paths(car.position, exclude=[car.original_destination], limit=1)
+                if ranked:
+                    best_path, best_exit, best_cost = ranked[0]
                 
                 if best_path and best_exit:
                     car.path = best_path
@@ -498,9 +1778,8 @@ class Simulation:
                 best_cost = float('inf')
                 
                 # Release old parking reservation
-                if car.destination in self.parking_lot.parking_status:
-                    if self.parking_lot.parking_status[car.destination] == 'reserved':
-                        self.parking_lot.parking_status[car.destination] = 'empty'
+                if self.parking_lot.parking_status.get(car.destination) == 'reserved':
+                    self.parking_lot.free_parking(car.destination)
                 
                 path, parking_spot, cost = self.parking_lot.find_shortest_path_to_parking(car.position)
                 
@@ -521,97 +1800,717 @@ class Simulation:
             self.total_deadlocks_resolved += 1
             break
     
+    def tick(self):
+        """Advance the simulation by a single tick"""
+        profiler = self.profiler
+        if profiler is not None:
+            started = time.perf_counter()
+        
+        # Spawn cars
+        if self.replay is not None:
+            arrivals = self.replay.arrivals
+            while self.replay_index < len(arrivals) and arrivals[self.replay_index][0] <= self.tick_count:
+                _, entry_point, parking_duration = arrivals[self.replay_index]
+                self.spawn_car(entry_point, parking_duration)
+                self.replay_index += 1
+        else:
+            self.spawn_timer += 1
+            if self.spawn_timer >= self.spawn_rate:
+                if self.spawn_rate >= 1:
+                    self.spawn_car()
+                    self.spawn_timer = 0
+                else:
+                    # Above one car per tick several arrivals fall due at once
+                    due = int(self.spawn_timer / self.spawn_rate + 1e-9)  # Slack for the float remainder
+                    for _ in range(due):
+                        self.spawn_car()
+                    self.spawn_timer -= due * self.spawn_rate
+        if profiler is not None:
+            started = profiler.lap('spawn', started)
+        
+        self.update_cars()
+        if profiler is not None:
+            started = profiler.lap('update_cars', started)
+        
+        # Deadlocks are found the tick they form and rerouted DEADLOCK_THRESHOLD ticks
+        # later, unless a car in the cycle got moving again in the meantime
+        for deadlocked_cars in self.detect_deadlock():
+            cycle = self.wait_graph.cycle_of[deadlocked_cars[0].id]  # The graph's own list, see is_deadlocked
+            self.pending_deadlocks.append((self.tick_count + DEADLOCK_THRESHOLD, cycle))
+        if profiler is not None:
+            started = profiler.lap('detect_deadlock', started)
+        while self.pending_deadlocks and self.pending_deadlocks[0][0] <= self.tick_count:
+            _, cycle = self.pending_deadlocks.popleft()
+            if not self.wait_graph.is_deadlocked(cycle):
+                continue
+            self.resolve_deadlock([self.cars_by_id[car_id] for car_id in cycle])
+            if self.wait_graph.is_deadlocked(cycle):
+                # No reroute was found; try again later
+                self.pending_deadlocks.append((self.tick_count + DEADLOCK_THRESHOLD, cycle))
+        if profiler is not None:
+            profiler.lap('resolve_deadlock', started)
+            if self.tick_ends_frame:
+                profiler.end_frame()
+        
+        self.counters.advance()
+        self.tick_count += 1
+    
+    def update_cars(self):
+        """Move every car one tick and drop the ones that have exited.
+
+        Everything in motion moves in one batched CarStore step. Per-car logic
+        only runs for cars that reached a cell centre and for cars with a
+        due event (a departure, or a freed segment they were waiting for).
+        """
+        store = self.store
+        scheduler = self.scheduler
+        cars_by_id = self.cars_by_id
+        tick = self.tick_count
+        
+        heap = [(car.id, car) for car in store.advance()]
+        queued = {car_id for car_id, _ in heap}
+        for car_id in scheduler.due(tick):
+            car = cars_by_id.get(car_id)
+            if car is not None and car_id not in queued and not store.moving[car.slot]:
+                heap.append((car_id, car))
+                queued.add(car_id)
+        # Run per-car logic in spawn order, as the per-car loop did, so cars
+        # contending for the same segment resolve the same way
+        heapq.heapify(heap)
+        running = [heap, queued, -1]
+        self._running = running
+        while heap:
+            car_id, car = heapq.heappop(heap)
+            running[2] = car_id
+            before = car.state
+            if store.moving[car.slot]:
+                car.arrive()
+            else:
+                # Catch the timers up on the ticks the car slept through
+                if before == 'parked':
+                    car.parked_timer = max(car.parked_timer, car.parking_duration - 1)
+                elif before == 'waiting':
+                    car.waiting_timer = tick - scheduler.waiting_since.get(car_id, tick) - 1
+                car.update()
+            
+            state = car.state
+            if state == 'exited':
+                self.remove_car(car)
+            elif state == 'parked':
+                # Sleep until departure; retry next tick if no exit route was found
+                scheduler.schedule(tick + car.parking_duration if before != 'parked' else tick + 1, car_id)
+            elif state == 'waiting':
+                if before != 'waiting':
+                    scheduler.waiting_since[car_id] = tick
+            elif not store.moving[car.slot]:
+                scheduler.wake(car_id)
+        self._running = None
+    
+    def wake_waiters(self, pos):
+        """Wake the cars waiting for a road segment that was just freed"""
+        waiters = self.wait_graph.waiters.get(pos)
+        if not waiters:
+            return
+        running = self._running
+        for car_id in waiters:
+            if running is not None and car_id > running[2]:
+                # Its turn in this tick is still to come, as in the per-car loop
+                if car_id not in running[1]:
+                    running[1].add(car_id)
+                    heapq.heappush(running[0], (car_id, self.cars_by_id[car_id]))
+            else:
+                self.scheduler.wake(car_id)
+    
+    def add_car(self, car):
+        """Append a car to self.cars and register it in cars_by_id"""
+        car.index = len(self.cars)
+        self.cars.append(car)
+        self.cars_by_id[car.id] = car
+    
+    def remove_car(self, car):
+        """Swap-remove a car from self.cars and cars_by_id, free its store slot and pool it"""
+        cars = self.cars
+        last = cars.pop()
+        if last is not car:
+            cars[car.index] = last
+            last.index = car.index
+        del self.cars_by_id[car.id]
+        self.scheduler.waiting_since.pop(car.id, None)
+        self.store.remove(car)
+        self.pool.release(car)
+    
+    def stats(self):
+        """Current simulation statistics, read in O(1) from running counters"""
+        stats = self.counters.snapshot()
+        stats['empty_spaces'] = self.parking_lot.status_count('empty')
+        stats['total_spawned'] = self.car_counter
+        stats['deadlocks_resolved'] = self.total_deadlocks_resolved
+        stats['tick'] = self.tick_count
+        return stats
+    
+    def telemetry_record(self):
+        """One flat record of the current state for telemetry sinks"""
+        stats = self.stats()
+        weights = self.parking_lot.weights_flat[self.parking_lot.road_nodes]
+        return {
+            'tick': self.tick_count,
+            'entering': stats['entering'],
+            'parked': stats['parked'],
+            'exiting': stats['exiting'],
+            'waiting': stats['waiting'],
+            'exited': stats['exited'],
+            'empty_spaces': stats['empty_spaces'],
+            'total_spawned': stats['total_spawned'],
+            'spawn_rejects': self.spawn_rejects,
+            'deadlocks_resolved': stats['deadlocks_resolved'],
+            'mean_road_weight': round(float(weights.mean()), 4),
+            'max_road_weight': round(float(weights.max()), 4),
+        }
+    
+    def telemetry(self, n_ticks=None, interval=1):
+        """Step the engine, yielding a telemetry record every interval ticks.
+        
+        Runs for n_ticks ticks, or for as long as the caller keeps pulling
+        records when n_ticks is None. Nothing is kept between records.
+        """
+        end = None if n_ticks is None else self.tick_count + n_ticks
+        while end is None or self.tick_count < end:
+            self.step(interval if end is None else min(interval, end - self.tick_count))
+            yield self.telemetry_record()
+    
+    def metrics(self):
+        """Throughput and mean times for comparing runs.
+        
+        Throughput is in cars per 60 ticks, the unit of cars_per_minute, so
+        the two compare directly; times are in seconds (60 ticks). Time to
+        park is the time cars spent on the way in (moving or waiting) per
+        car that parked; wait time is averaged over every car spawned.
+        """
+        counters = self.counters
+        car_ticks = counters.car_ticks
+        periods = self.tick_count / 60
+        parked = counters.transitions['parked']
+        waiting = car_ticks[('waiting', False)] + car_ticks[('waiting', True)]
+        return {
+            'exits_per_60_ticks': counters.counts['exited'] / periods if periods else 0.0,
+            'mean_time_to_park_s': (car_ticks['entering'] + car_ticks[('waiting', False)]) / parked / 60
+                                   if parked else 0.0,
+            'mean_wait_s': waiting / self.car_counter / 60 if self.car_counter else 0.0,
+            'deadlocks_resolved': self.total_deadlocks_resolved,
+            'spawned': self.car_counter,
+            'exited': counters.counts['exited'],
+        }
+    
+    def digest(self):
+        """SHA-256 of the simulation outcome: every car, road weight and stall status.
+        
+        Two runs with equal digests ended in bit-for-bit the same state.
+        """
+        sha = hashlib.sha256()
+        sha.update(self.parking_lot.road_weights.tobytes())
+        sha.update(self.parking_lot.status_grid.tobytes())
+        sha.update(repr(sorted(self.parking_lot.road_occupancy.items())).encode())
+        for car in sorted(self.cars, key=lambda car: car.id):
+            sha.update(repr((car.id, car.state, car.is_exiting, car.position, car.destination, car.path,
+                             car.current_path_index, car.visual_position, car.parked_timer,
+                             car.parking_duration)).encode())
+        sha.update(repr(sorted(self.stats().items())).encode())
+        return sha.hexdigest()
+    
+    def step(self, n_ticks=1):
+        """Advance the simulation by n_ticks and return the current tick"""
+        for _ in range(n_ticks):
+            self.tick()
+        return self.tick_count
+    
+    def run_until(self, tick):
+        """Advance the simulation until tick_count reaches the given tick"""
+        if tick > self.tick_count:
+            self.step(tick - self.tick_count)
+        return self.tick_count
+    
+    @staticmethod
+    def _pack_lists(lists):
+        """Flatten a list of cell lists into an (n, 2) array and offsets into it"""
+        offsets = np.zeros(len(lists) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(cells) for cells in lists])
+        cells = [cell for cells in lists for cell in cells]
+        return np.array(cells, dtype=np.int32).reshape(-1, 2), offsets
+    
+    @staticmethod
+    def _unpack_lists(cells, offsets):
+        """Inverse of _pack_lists: a list of lists of (row, col) tuples"""
+        cells = [tuple(cell) for cell in cells.tolist()]
+        offsets = offsets.tolist()
+        return [cells[start:end] for start, end in zip(offsets, offsets[1:])]
+    
+    def save_checkpoint(self, path):
+        """Write the complete simulation state to a compressed .npz file.
+        
+        Everything that decides how the run continues is saved as arrays:
+        the lot (weights, stall statuses, road occupancy, exit field), every
+        car with its paths and timers, the store, scheduler, wait-for graph,
+        pending deadlocks, counters and RNG state. Scalars go into a small
+        JSON header. Profiler and route cache are not saved.
+        """
+        lot = self.parking_lot
+        layout = self.layout
+        field = lot.exit_field
+        cars = self.cars
+        none_cell = (-1, -1)
+        
+        version, rng_state, gauss_next = self.rng.getstate()
+        meta = {
+            'format': 1,
+            'layout': {'rows': layout.rows, 'cols': layout.cols, 'stall_rows': layout.stall_rows,
+                       'road_rows': layout.road_rows, 'stall_cols': layout.stall_cols,
+                       'road_cols': layout.road_cols, 'entry_points': layout.entry_points,
+                       'exit_points': layout.exit_points, 'cell_size': layout.cell_size},
+            'parking_search': lot.parking_search,
+            'cars_per_minute': self.cars_per_minute,
+            'seed': self.seed,
+            'rng': [version, gauss_next],
+            'record': self.arrival_log is not None,
+            'replay_index': self.replay_index,
+            'car_counter': self.car_counter,
+            'spawn_timer': self.spawn_timer,
+            'total_deadlocks_resolved': self.total_deadlocks_resolved,
+            'spawn_rejects': self.spawn_rejects,
+            'tick_count': self.tick_count,
+            'weight_epoch': lot.weight_epoch,
+            'stalls_freed': lot.stalls_freed,
+            'searches': [lot.pathfinder.search_count, lot.pathfinder.total_expanded],
+            'exit_field': [field.valid, field.rebuilds, field.repairs],
+            'pool': [self.pool.created, self.pool.reused],
+            'counters': [[name, [[key, value] for key, value in table.items()]]
+                         for name, table in (('counts', self.counters.counts),
+                                             ('car_ticks', self.counters.car_ticks),
+                                             ('transitions', self.counters.transitions))],
+        }
+        
+        occupancy = list(lot.road_occupancy.items())
+        paths, path_offsets = self._pack_lists([car.path for car in cars])
+        original_paths, original_offsets = self._pack_lists([car.original_path or [] for car in cars])
+        cycles, cycle_offsets = self._pack_lists([[(car_id, 0) for car_id in cycle]
+                                                  for _, cycle in self.pending_deadlocks])
+        known_cycles = list({id(cycle): cycle for cycle in self.wait_graph.cycle_of.values()}.values())
+        known, known_offsets = self._pack_lists([[(car_id, 0) for car_id in cycle] for cycle in known_cycles])
+        store = self.store
+        dependencies = list(self.wait_graph.dependencies.items())
+        arrays = {
+            'meta': np.frombuffer(json.dumps(meta).encode(), dtype=np.uint8),
+            'rng_state': np.array(rng_state, dtype=np.uint32),
+            'road_weights': lot.road_weights,
+            'status_grid': lot.status_grid,
+            'occupancy_cells': np.array([pos for pos, _ in occupancy], dtype=np.int32).reshape(-1, 2),
+            'occupancy_cars': np.array([-1 if car_id is None else car_id for _, car_id in occupancy],
+                                       dtype=np.int64),
+            'exit_dist': np.array(field.dist),
+            'exit_next_hop': np.array(field.next_hop, dtype=np.int64),
+            'exit_dirty_weights': field.dirty_weights,
+            'exit_dirty_nodes': np.array(field.dirty_nodes, dtype=np.int64),
+            'exit_dirty_chunks': np.concatenate(field.dirty_chunks or [np.zeros(0, dtype=np.intp)]),
+            'exit_chunk_lengths': np.array([len(chunk) for chunk in field.dirty_chunks], dtype=np.int64),
+            'car_ids': np.array([car.id for car in cars], dtype=np.int64),
+            'car_slots': np.array([car.slot for car in cars], dtype=np.int64),
+            'car_states': np.array([CarStore.STATE_CODES[car.state] for car in cars], dtype=np.int8),
+            'car_cells': np.array([car.position + car.destination
+                                   + (car.target_segment or none_cell) + (car.original_destination or none_cell)
+                                   for car in cars], dtype=np.int32).reshape(-1, 8),
+            'car_ints': np.array([(car.current_path_index, car.parking_duration, car.parked_timer,
+                                   car.waiting_timer, car.is_exiting, car.in_deadlock,
+                                   car.original_path is not None) for car in cars], dtype=np.int64).reshape(-1, 7),
+            'car_speeds': np.array([car.move_speed for car in cars]),
+            'paths': paths, 'path_offsets': path_offsets,
+            'original_paths': original_paths, 'original_offsets': original_offsets,
+            'store_floats': np.stack([store.x, store.y, store.target_x, store.target_y, store.speed]),
+            'store_state': store.state,
+            'store_moving': store.moving,
+            'store_free_slots': np.array(store.free_slots, dtype=np.int64),
+            'departures': np.array(self.scheduler.departures, dtype=np.int64).reshape(-1, 2),
+            'wakes': np.array(sorted(self.scheduler.wakes), dtype=np.int64),
+            'waiting_since': np.array(list(self.scheduler.waiting_since.items()), dtype=np.int64).reshape(-1, 2),
+            'dependency_cars': np.array([car_id for car_id, _ in dependencies], dtype=np.int64),
+            'dependency_cells': np.array([segment for _, segment in dependencies], dtype=np.int32).reshape(-1, 2),
+            'changed': np.array(self.wait_graph.changed, dtype=np.int64),
+            'known_cycles': known, 'known_offsets': known_offsets,
+            'pending_ticks': np.array([tick for tick, _ in self.pending_deadlocks], dtype=np.int64),
+            'pending_cycles': cycles, 'pending_offsets': cycle_offsets,
+            'pending_intact': np.array([self.wait_graph.is_deadlocked(cycle) for _, cycle in self.pending_deadlocks],
+                                       dtype=bool),
+        }
+        if self.arrival_log is not None:
+            arrays['arrivals'] = np.array([(tick, row, col, duration)
+                                           for tick, (row, col), duration in self.arrival_log.arrivals],
+                                          dtype=np.int64).reshape(-1, 4)
+        np.savez_compressed(path, **arrays)
+    
+    @classmethod
+    def load_checkpoint(cls, path, seed=None, replay=None):
+        """Rebuild an engine (or Simulation) from a save_checkpoint file.
+        
+        The restored run continues exactly as the saved one would have. To
+        fork several different experiments from one snapshot, pass a seed:
+        the RNG is then reseeded with it instead of restored. A replay log
+        is not part of the checkpoint; pass it again to keep replaying.
+        """
+        with np.load(path, allow_pickle=False) as data:
+            data = dict(data)
+        meta = json.loads(data['meta'].tobytes())
+        spec = meta['layout']
+        layout = LotLayout(spec['rows'], spec['cols'], spec['stall_rows'], spec['road_rows'], spec['stall_cols'],
+                           spec['road_cols'], [tuple(pos) for pos in spec['entry_points']],
+                           [tuple(pos) for pos in spec['exit_points']], spec['cell_size'])
+        statuses = {code: status for status, code in STATUS_CODES.items()}
+        status_grid = data['status_grid']
+        rows, cols = np.nonzero(status_grid >= 0)
+        parking_status = {(row, col): statuses[code]
+                          for row, col, code in zip(rows.tolist(), cols.tolist(), status_grid[rows, cols].tolist())}
+        engine = cls(meta['cars_per_minute'], layout, seed=meta['seed'], parking_status=parking_status)
+        engine.replay = replay
+        engine.replay_index = meta['replay_index']
+        if meta['record']:
+            engine.arrival_log = ArrivalLog((tick, (row, col), duration)
+                                            for tick, row, col, duration in data['arrivals'].tolist())
+        if seed is None:
+            version, gauss_next = meta['rng']
+            engine.rng.setstate((version, tuple(data['rng_state'].tolist()), gauss_next))
+        else:
+            engine.seed = seed
+            engine.rng.seed(seed)
+        engine.car_counter = meta['car_counter']
+        engine.spawn_timer = meta['spawn_timer']
+        engine.total_deadlocks_resolved = meta['total_deadlocks_resolved']
+        engine.spawn_rejects = meta['spawn_rejects']
+        engine.tick_count = meta['tick_count']
+        engine.pool.created, engine.pool.reused = meta['pool']
+        for name, items in meta['counters']:
+            table = getattr(engine.counters, name)
+            for key, value in items:
+                table[tuple(key) if isinstance(key, list) else key] = value
+        
+        # Lot
+        lot = engine.parking_lot
+        lot.parking_search = meta['parking_search']
+        lot.road_weights[:] = data['road_weights']
+        lot.road_occupancy = {tuple(pos): (None if car_id == -1 else car_id) for pos, car_id
+                              in zip(data['occupancy_cells'].tolist(), data['occupancy_cars'].tolist())}
+        lot.weight_epoch = meta['weight_epoch']
+        lot.stalls_freed = meta['stalls_freed']
+        lot.pathfinder.search_count, lot.pathfinder.total_expanded = meta['searches']
+        field = lot.exit_field
+        field.valid, field.rebuilds, field.repairs = meta['exit_field']
+        field.dist = data['exit_dist'].tolist()
+        field.next_hop = data['exit_next_hop'].tolist()
+        field.dirty_weights = data['exit_dirty_weights'].copy()
+        field.dirty_nodes = data['exit_dirty_nodes'].tolist()
+        chunks = data['exit_dirty_chunks'].astype(np.intp)
+        field.dirty_chunks = np.split(chunks, np.cumsum(data['exit_chunk_lengths'])[:-1]) \
+            if len(data['exit_chunk_lengths']) else []
+        
+        # Cars and their store slots
+        store = engine.store
+        floats = data['store_floats']
+        store.capacity = floats.shape[1]
+        store.x, store.y, store.target_x, store.target_y, store.speed = (row.copy() for row in floats)
+        store.state = data['store_state'].copy()
+        store.moving = data['store_moving'].copy()
+        store.free_slots = data['store_free_slots'].tolist()
+        store.cars = [None] * store.capacity
+        state_names = {code: state for state, code in CarStore.STATE_CODES.items()}
+        paths = cls._unpack_lists(data['paths'], data['path_offsets'])
+        original_paths = cls._unpack_lists(data['original_paths'], data['original_offsets'])
+        for i, (car_id, slot, state, cells, ints, speed) in enumerate(zip(
+                data['car_ids'].tolist(), data['car_slots'].tolist(), data['car_states'].tolist(),
+                data['car_cells'].tolist(), data['car_ints'].tolist(), data['car_speeds'].tolist())):
+            car = Car.__new__(Car)
+            car.id = car_id
+            car.parking_lot = lot
+            car.store = store
+            car.wait_graph = engine.wait_graph
+            car.counters = engine.counters
+            car.slot = slot
+            car._visual_position = None
+            car._state = state_names[state]
+            car.move_speed = speed
+            car.path = paths[i]
+            car.position = tuple(cells[0:2])
+            car.destination = tuple(cells[2:4])
+            car.target_segment = tuple(cells[4:6]) if cells[4] != -1 else None
+            car.original_destination = tuple(cells[6:8]) if cells[6] != -1 else None
+            (car.current_path_index, car.parking_duration, car.parked_timer, car.waiting_timer,
+             is_exiting, in_deadlock, has_original) = ints
+            car.is_exiting = bool(is_exiting)
+            car.in_deadlock = bool(in_deadlock)
+            car.original_path = original_paths[i] if has_original else None
+            store.cars[slot] = car
+            engine.add_car(car)
+        
+        # Scheduler, wait-for graph and pending deadlocks
+        scheduler = engine.scheduler
+        scheduler.departures = [tuple(event) for event in data['departures'].tolist()]
+        scheduler.wakes = set(data['wakes'].tolist())
+        scheduler.waiting_since = dict(map(tuple, data['waiting_since'].tolist()))
+        graph = engine.wait_graph
+        for car_id, segment in zip(data['dependency_cars'].tolist(), data['dependency_cells'].tolist()):
+            graph.dependencies[car_id] = tuple(segment)
+            graph.waiters.setdefault(tuple(segment), set()).add(car_id)
+        graph.changed = data['changed'].tolist()
+        for cycle in cls._unpack_lists(data['known_cycles'], data['known_offsets']):
+            cycle = [car_id for car_id, _ in cycle]
+            for car_id in cycle:
+                graph.cycle_of[car_id] = cycle
+        pending = zip(data['pending_ticks'].tolist(), data['pending_intact'].tolist(),
+                      cls._unpack_lists(data['pending_cycles'], data['pending_offsets']))
+        # Intact cycles must be the graph's own lists again for is_deadlocked
+        engine.pending_deadlocks = deque(
+            (tick, graph.cycle_of[cycle[0][0]] if intact else [car_id for car_id, _ in cycle])
+            for tick, intact, cycle in pending)
+        return engine
+
+
+class GlyphCache:
+    """Bounded LRU cache of rendered text surfaces, keyed by the text"""
+    def __init__(self, render, max_size=256):
+        self.render = render  # text -> surface
+        self.max_size = max_size
+        self.surfaces = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, text):
+        """Return the surface for text, rendering it on a miss"""
+        surface = self.surfaces.get(text)
+        if surface is not None:
+            self.surfaces.move_to_end(text)
+            self.hits += 1
+            return surface
+        self.misses += 1
+        surface = self.surfaces[text] = self.render(text)
+        if len(self.surfaces) > self.max_size:
+            self.surfaces.popitem(last=False)
+        return surface
+    
+    def stats(self):
+        """Hit/miss counters and current size"""
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.surfaces),
+                'hit_rate': self.hits / lookups if lookups else 0.0}
+
+
+class Simulation(SimulationEngine):
+    """Pygame front end that renders a SimulationEngine at 60 fps.
+
+    Weight labels can be quantized to multiples of ``label_step`` (fewer
+    distinct glyphs, fewer tile redraws) and are hidden entirely when cells
+    are smaller than ``label_min_cell_size`` pixels. The window is sized
+    from the layout's dimensions and cell size.
+
+    With ``profile`` the frame phases are timed by a Profiler, shown in an
+    overlay that F3 toggles, and written to ``profile_path`` (if given) when
+    the window is closed. A ``telemetry`` sink gets a record every
+    ``telemetry_interval`` ticks and is closed with the window.
+    """
+    def __init__(self, cars_per_minute, layout=None, label_step=None, label_min_cell_size=16,
+                 label_cache_size=256, profile=False, profile_path=None, seed=None, telemetry=None,
+                 telemetry_interval=60, parking_status=None):
+        if pygame is None:
+            raise ImportError("pygame is required for the visual simulation; "
+                              "use SimulationEngine for headless runs")
+        super().__init__(cars_per_minute, layout, seed, parking_status=parking_status)
+        pygame.init()
+        window_width, window_height = self.layout.window_size
+        self.screen = pygame.display.set_mode((window_width, window_height))
+        pygame.display.set_caption("Parking Lot Simulation")
+        self.clock = pygame.time.Clock()
+        self.font = pygame.font.Font(None, 20)
+        self.small_font = pygame.font.Font(None, 16)
+        self.running = True
+        self.label_step = label_step
+        # Cars move in CELL_SIZE pixel units; the lot may be drawn at another cell size
+        self.cell_size = self.layout.cell_size
+        self.scale = self.cell_size / CELL_SIZE
+        self.show_labels = self.cell_size >= label_min_cell_size
+        self.label_cache = GlyphCache(lambda text: self.small_font.render(text, True, TEXT_COLOR),
+                                      label_cache_size)
+        
+        # The lot is rendered once to lot_surface; afterwards only tiles whose
+        # stall status or weight label changed are redrawn, and only changed
+        # rectangles are pushed to the display
+        lot_height = self.layout.rows * self.cell_size
+        self.lot_surface = pygame.Surface((window_width, lot_height))
+        shape = self.parking_lot.cells.shape
+        self.drawn_labels = np.full(shape, np.nan)  # Weights as last drawn, to 0.1
+        self.drawn_status = np.full(shape, -2, dtype=np.int8)  # Forces a full first draw
+        self.stats_rect = pygame.Rect(0, lot_height, window_width, window_height - lot_height)
+        self.stats_lines = None
+        self.car_rects = []
+        self.full_redraw = True
+        if profile:
+            self.enable_profiling()
+        self.tick_ends_frame = False  # run() closes each frame after events, tick, drawing and the wait
+        self.profile_path = profile_path
+        self.show_profile = profile
+        self.telemetry_sink = telemetry
+        self.telemetry_interval = telemetry_interval
+    
+    def draw_tile(self, row, col):
+        """Draw one cell of the lot onto lot_surface and return its rect"""
+        cell_size = self.cell_size
+        x = col * cell_size
+        y = row * cell_size
+        rect = pygame.Rect(x, y, cell_size, cell_size)
+        surface = self.lot_surface
+        
+        if self.parking_lot.grid[row][col] == 'road':
+            # Draw road with weight
+            pygame.draw.rect(surface, ROAD_COLOR, rect)
+            if self.show_labels:
+                weight = self.parking_lot.road_weights[row][col]
+                if self.label_step:
+                    weight = round(weight / self.label_step) * self.label_step
+                text = self.label_cache.get(f"{weight:.1f}")
+                text_rect = text.get_rect(center=(x + cell_size // 2, y + cell_size // 2))
+                surface.blit(text, text_rect)
+        elif self.parking_lot.grid[row][col] == 'parking':
+            status = self.parking_lot.parking_status.get((row, col), 'empty')
+            if status == 'empty':
+                color = EMPTY_PARKING_COLOR
+            elif status == 'reserved':
+                color = RESERVED_PARKING_COLOR
+            else:  # occupied
+                color = OCCUPIED_PARKING_COLOR
+            pygame.draw.rect(surface, color, rect)
+        else:
+            pygame.draw.rect(surface, BLACK, rect)
+        
+        # Draw grid lines (skipped once cells are too small to show them)
+        if cell_size > 3:
+            pygame.draw.rect(surface, BLACK, rect, 1)
+        return rect
+    
+    def update_tiles(self):
+        """Redraw the tiles whose status or weight label changed; return their rects"""
+        lot = self.parking_lot
+        if not self.show_labels:
+            labels = np.zeros_like(lot.road_weights)  # Weight changes never need a redraw
+        elif self.label_step:
+            labels = np.round(lot.road_weights / self.label_step) * self.label_step
+        else:
+            labels = np.round(lot.road_weights, 1)
+        changed = ((labels != self.drawn_labels) & (lot.cells == CELL_ROAD)) | (lot.status_grid != self.drawn_status)
+        self.drawn_labels = labels
+        self.drawn_status[:] = lot.status_grid
+        rows, cols = np.nonzero(changed)
+        return [self.draw_tile(row, col) for row, col in zip(rows.tolist(), cols.tolist())]
+    
     def draw(self):
-        """Draw the parking lot and cars"""
-        self.screen.fill(BLACK)
-        
-        # Draw grid
-        for row in range(GRID_SIZE):
-            for col in range(GRID_SIZE):
-                x = col * CELL_SIZE
-                y = row * CELL_SIZE
-                
-                if self.parking_lot.grid[row][col] == 'road':
-                    # Draw road with weight
-                    pygame.draw.rect(self.screen, ROAD_COLOR, (x, y, CELL_SIZE, CELL_SIZE))
-                    weight = self.parking_lot.road_weights[row][col]
-                    text = self.small_font.render(f"{weight:.1f}", True, TEXT_COLOR)
-                    text_rect = text.get_rect(center=(x + CELL_SIZE // 2, y + CELL_SIZE // 2))
-                    self.screen.blit(text, text_rect)
-                elif self.parking_lot.grid[row][col] == 'parking':
-                    status = self.parking_lot.parking_status.get((row, col), 'empty')
-                    if status == 'empty':
-                        color = EMPTY_PARKING_COLOR
-                    elif status == 'reserved':
-                        color = RESERVED_PARKING_COLOR
-                    else:  # occupied
-                        color = OCCUPIED_PARKING_COLOR
-                    pygame.draw.rect(self.screen, color, (x, y, CELL_SIZE, CELL_SIZE))
-                
-                # Draw grid lines
-                pygame.draw.rect(self.screen, BLACK, (x, y, CELL_SIZE, CELL_SIZE), 1)
+        """Draw the parking lot and cars, pushing only changed areas to the display"""
+        screen = self.screen
+        dirty = self.update_tiles()
+        
+        # Erase last frame's cars and bring changed tiles up to date
+        if self.full_redraw:
+            screen.fill(BLACK)
+            screen.blit(self.lot_surface, (0, 0))
+            self.stats_lines = None
+        else:
+            for rect in self.car_rects + dirty:
+                screen.blit(self.lot_surface, rect, rect)
         
         # Draw cars
+        car_rects = []
+        scale = self.scale
+        radius = max(1, self.cell_size // 3)
         for car in self.cars:
             if car.state in ['entering', 'exiting', 'waiting']:
-                x = int(car.visual_position[0])
-                y = int(car.visual_position[1])
+                x = int(car.visual_position[0] * scale)
+                y = int(car.visual_position[1] * scale)
                 color = EXIT_CAR_COLOR if car.is_exiting else CAR_COLOR
-                pygame.draw.circle(self.screen, color, (x, y), CELL_SIZE // 3)
+                car_rects.append(pygame.draw.circle(screen, color, (x, y), radius))
+        
+        # Profiler overlay, erased next frame along with the cars
+        if self.profiler is not None and self.show_profile:
+            car_rects.append(self.draw_profile())
+        dirty += self.car_rects + car_rects
+        self.car_rects = car_rects
         
         # Draw statistics
-        stats_y = GRID_SIZE * CELL_SIZE + 10
-        entering_cars = len([c for c in self.cars if c.state in ['entering', 'waiting'] and not c.is_exiting])
-        exiting_cars = len([c for c in self.cars if c.state in ['exiting', 'waiting'] and c.is_exiting])
-        parked_cars = len([c for c in self.cars if c.state == 'parked'])
-        waiting_cars = len([c for c in self.cars if c.state == 'waiting'])
+        current = self.stats()
+        entering_cars = current['entering']
+        exiting_cars = current['exiting']
+        parked_cars = current['parked']
+        waiting_cars = current['waiting']
         
         stats = [
             f"Entering: {entering_cars} | Parked: {parked_cars} | Exiting: {exiting_cars} | Waiting: {waiting_cars}",
-            f"Total spawned: {self.car_counter} | Empty spaces: {len([s for s in self.parking_lot.parking_status.values() if s == 'empty'])}",
-            f"Deadlocks resolved: {self.total_deadlocks_resolved}"
+            f"Total spawned: {current['total_spawned']} | Empty spaces: {current['empty_spaces']}",
+            f"Deadlocks resolved: {current['deadlocks_resolved']}"
         ]
         
-        for i, stat in enumerate(stats):
-            text = self.font.render(stat, True, TEXT_COLOR)
-            self.screen.blit(text, (10, stats_y + i * 25))
+        if stats != self.stats_lines:
+            self.stats_lines = stats
+            screen.fill(BLACK, self.stats_rect)
+            stats_y = self.stats_rect.top + 10
+            for i, stat in enumerate(stats):
+                text = self.font.render(stat, True, TEXT_COLOR)
+                screen.blit(text, (10, stats_y + i * 25))
+            dirty.append(self.stats_rect)
         
-        pygame.display.flip()
+        if self.full_redraw:
+            pygame.display.flip()
+            self.full_redraw = False
+        else:
+            pygame.display.update(dirty)
+    
+    def draw_profile(self):
+        """Draw the profiler report over the top left of the lot and return its rect"""
+        lines = self.profiler.lines()
+        width = max((self.small_font.size(line)[0] for line in lines), default=0) + 8
+        rect = pygame.Rect(0, 0, width, len(lines) * 14 + 6).clip(self.screen.get_rect())
+        self.screen.fill(BLACK, rect)
+        for i, line in enumerate(lines):
+            self.screen.blit(self.small_font.render(line, True, TEXT_COLOR), (4, 4 + i * 14))
+        return rect
     
     def run(self):
         """Main simulation loop"""
+        profiler = self.profiler
         while self.running:
+            if profiler is not None:
+                started = time.perf_counter()
             for event in pygame.event.get():
                 if event.type == pygame.QUIT:
                     self.running = False
+                elif event.type == pygame.VIDEOEXPOSE:
+                    self.full_redraw = True  # The window was uncovered; repaint all of it
+                elif event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+                    self.show_profile = not self.show_profile
+            if profiler is not None:
+                profiler.lap('events', started)
             
-            # Spawn cars
-            self.spawn_timer += 1
-            if self.spawn_timer >= self.spawn_rate:
-                self.spawn_car()
-                self.spawn_timer = 0
-            
-            # Update cars
-            for car in self.cars:
-                car.update()
-            
-            # Remove exited cars
-            self.cars = [car for car in self.cars if car.state != 'exited']
-            
-            # Check for deadlocks periodically
-            self.deadlock_check_timer += 1
-            if self.deadlock_check_timer >= 30:  # Check every 0.5 seconds
-                deadlocked_cars = self.detect_deadlock()
-                if deadlocked_cars:
-                    self.resolve_deadlock(deadlocked_cars)
-                self.deadlock_check_timer = 0
+            # Advance the simulation by one frame
+            self.tick()
+            if self.telemetry_sink is not None and self.tick_count % self.telemetry_interval == 0:
+                self.telemetry_sink.write(self.telemetry_record())
             
             # Draw
+            if profiler is not None:
+                started = time.perf_counter()
             self.draw()
+            if profiler is not None:
+                started = profiler.lap('draw', started)
             
             # Control frame rate
             self.clock.tick(60)
+            if profiler is not None:
+                profiler.lap('clock_wait', started)
+                profiler.end_frame()
         
+        if profiler is not None and self.profile_path:
+            profiler.dump(self.profile_path)
+        if self.telemetry_sink is not None:
+            self.telemetry_sink.close()
         pygame.quit()
 
 
@@ -640,7 +2539,13 @@ def main():
     print(f"\nStarting simulation with {cars_per_minute} cars per minute...")
     print("Close the window to exit the simulation.\n")
     
-    sim = Simulation(cars_per_minute)
+    # python3 parking_lot_simulation.py --profile shows frame timings (F3) and saves them to profile.json
+    profile = '--profile' in sys.argv
+    # --telemetry=FILE writes one record per simulated second (CSV for .csv, else NDJSON)
+    telemetry = next((open_telemetry_sink(arg.split('=', 1)[1]) for arg in sys.argv[1:]
+                      if arg.startswith('--telemetry=')), None)
+    sim = Simulation(cars_per_minute, profile=profile, profile_path='profile.json' if profile else None,
+                     telemetry=telemetry)
     sim.run()
 
 
@@ -18,23 +18,23 @@ if errorlevel 1 (
 echo [OK] Python found
 python --version
 
-REM Check if pygame is installed
-python -c "import pygame" >nul 2>&1
+REM Check if pygame and numpy are installed
+python -c "import pygame, numpy" >nul 2>&1
 if errorlevel 1 (
     echo.
-    echo [!] Pygame is not installed
-    echo Installing pygame...
-    pip install pygame
+    echo [!] Pygame or NumPy is not installed
+    echo Installing requirements...
+    pip install -r requirements.txt
    
     if errorlevel 1 (
-        echo X Failed to install pygame
-        echo Please run: pip install pygame
+        echo X Failed to install requirements
+        echo Please run: pip install -r requirements.txt
         pause
         exit /b 1
     )
-    echo [OK] Pygame installed successfully
+    echo [OK] Requirements installed successfully
 ) else (
-    echo [OK] Pygame is already installed
+    echo [OK] Pygame and NumPy are already installed
 )
 
 echo.
@@ -16,21 +16,21 @@ fi
 
 echo "✓ Python 3 found: $(python3 --version)"
 
-# Check if pygame is installed
-if ! python3 -c "import pygame" 2>/dev/null; then
+# Check if pygame and numpy are installed
+if ! python3 -c "import pygame, numpy" 2>/dev/null; then
     echo ""
-    echo "⚠️  Pygame is not installed"
-    echo "Installing pygame..."
-    pip install pygame
+    echo "⚠️  Pygame or NumPy is not installed"
+    echo "Installing requirements..."
+    pip install -r requirements.txt
     
     if [ $? -ne 0 ]; then
-        echo "❌ Failed to install pygame"
-        echo "Please run: pip install pygame"
+        echo "❌ Failed to install requirements"
+        echo "Please run: pip install -r requirements.txt"
         exit 1
     fi
-    echo "✓ Pygame installed successfully"
+    echo "✓ Requirements installed successfully"
 else
-    echo "✓ Pygame is already installed"
+    echo "✓ Pygame and NumPy are already installed"
 fi
 
 echo ""
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Parameter sweep over headless simulations (no GUI required)
+
+Runs one SimulationEngine per combination of arrival rate, lot layout and
+seed on a process pool, then prints throughput, time to park, wait time and
+deadlocks per rate and layout, averaged over the seeds. Arrival rates and
+throughput are both in cars per 60 ticks (the unit of cars_per_minute);
+run lengths are in minutes of 3600 ticks at 60 fps.
+
+    python3 sweep.py --rates 5,10,30,60 --layouts 31,61 --seeds 1,2,3 --minutes 10
+    python3 sweep.py --rates 10,60 --layouts 31x61 --json sweep.json
+"""
+
+import argparse
+import itertools
+import json
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from parking_lot_simulation import LotLayout, SimulationEngine
+
+TICKS_PER_MINUTE = 3600  # 60 ticks per second
+METRICS = ('exits_per_60_ticks', 'mean_time_to_park_s', 'mean_wait_s', 'deadlocks_resolved')
+
+
+def parse_layout(text):
+    """'31' is a 31x31 lot, '31x61' is 31 rows by 61 columns"""
+    rows, _, cols = text.lower().partition('x')
+    return int(rows), int(cols or rows)
+
+
+def run_one(job):
+    """Run one simulation and return its parameters and metrics (called in a worker)"""
+    rate, (rows, cols), seed, minutes = job
+    engine = SimulationEngine(rate, LotLayout(rows, cols), seed=seed)
+    started = time.perf_counter()
+    engine.step(int(minutes * TICKS_PER_MINUTE))
+    result = {'rate': rate, 'layout': f"{rows}x{cols}", 'seed': seed}
+    result.update(engine.metrics())
+    result['wall_s'] = time.perf_counter() - started
+    return result
+
+
+def sweep(rates, layouts, seeds, minutes, workers=None):
+    """Run every combination, spread over `workers` processes (default: every core)"""
+    jobs = [(rate, layout, seed, minutes) for rate, layout, seed in itertools.product(rates, layouts, seeds)]
+    if workers == 1:
+        return [run_one(job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # Several jobs per task keeps the pool busy without a round trip per run
+        chunksize = max(1, len(jobs) // ((workers or os.cpu_count() or 1) * 4))
+        return list(pool.map(run_one, jobs, chunksize=chunksize))
+
+
+def aggregate(results):
+    """Mean and spread of each metric per (rate, layout), over the seeds"""
+    groups = {}
+    for result in results:
+        groups.setdefault((result['rate'], result['layout']), []).append(result)
+    rows = []
+    for (rate, layout), runs in sorted(groups.items(), key=lambda item: (parse_layout(item[0][1]), item[0][0])):
+        row = {'rate': rate, 'layout': layout, 'runs': len(runs)}
+        for metric in METRICS:
+            values = [run[metric] for run in runs]
+            row[metric] = statistics.mean(values)
+            row[metric + '_stdev'] = statistics.stdev(values) if len(values) > 1 else 0.0
+        rows.append(row)
+    return rows
+
+
+def print_table(rows):
+    """Print the aggregate table, one line per layout and rate"""
+    print(f"{'layout':>8} {'in/60t':>7} {'runs':>5} {'out/60t':>8} {'park s':>8} {'wait s':>8} {'deadlocks':>10}")
+    for row in rows:
+        print(f"{row['layout']:>8} {row['rate']:>7} {row['runs']:>5} {row['exits_per_60_ticks']:>8.2f} "
+              f"{row['mean_time_to_park_s']:>8.1f} {row['mean_wait_s']:>8.1f} {row['deadlocks_resolved']:>10.1f}")
+    print("in/60t: arrival rate and out/60t: exits, both in cars per 60 ticks; times in seconds (60 ticks)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rates', default='5,10,30,60', help="comma-separated arrival rates, in cars per 60 ticks")
+    parser.add_argument('--layouts', default='31', help="comma-separated lot sizes, '31' or '31x61'")
+    parser.add_argument('--seeds', default='1,2,3', help="comma-separated seeds, one run per seed")
+    parser.add_argument('--minutes', type=float, default=10, help="simulated minutes (3600 ticks) per run")
+    parser.add_argument('--workers', type=int, default=None, help="worker processes (default: every core)")
+    parser.add_argument('--json', help="also write every run and the aggregate table to this file")
+    args = parser.parse_args(argv)
+    
+    rates = [int(rate) for rate in args.rates.split(',')]
+    layouts = [parse_layout(layout) for layout in args.layouts.split(',')]
+    seeds = [int(seed) for seed in args.seeds.split(',')]
+    runs = len(rates) * len(layouts) * len(seeds)
+    print(f"Running {runs} simulations of {args.minutes} simulated minutes "
+          f"on {args.workers or os.cpu_count()} worker(s)...")
+    
+    started = time.perf_counter()
+    results = sweep(rates, layouts, seeds, args.minutes, args.workers)
+    rows = aggregate(results)
+    print_table(rows)
+    print(f"\n{runs} runs in {time.perf_counter() - started:.1f} s "
+          f"({sum(result['wall_s'] for result in results):.1f} s of simulation time)")
+    
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'runs': results, 'table': rows}, f, indent=2)
+        print(f"Results written to {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,10 +3,11 @@
 Test script to verify the enhanced parking lot simulation features
 """
 
+import os
 import sys
 sys.path.insert(0, '/vercel/sandbox')
 
-from parking_lot_simulation import ParkingLot, Car, ENTRY_POINTS, EXIT_POINTS
+from parking_lot_simulation import ParkingLot, LotLayout, Car, CarPool, CarStore, GlyphCache, SimulationEngine, ExitField, ENTRY_POINTS, EXIT_POINTS
 
 def test_entry_exit_points():
     """Test that entry and exit points are correctly defined"""
@@ -136,7 +137,7 @@ def test_car_initialization():
     path, parking, cost = lot.find_shortest_path_to_parking(entry)
     
     if path and parking:
-        car = Car(1, entry, path, parking, lot, is_exiting=False)
+        car = Car(1, entry, path, parking, lot, is_exiting=False, parking_duration=600)
         
         # Check attributes
         assert car.id == 1, "Car ID should be 1"
@@ -151,6 +152,778 @@ def test_car_initialization():
     else:
         print("⚠ Could not test car initialization (no path found)")
 
+def test_headless_engine():
+    """Test the headless engine runs without a display"""
+    print("\nTesting headless engine...")
+    engine = SimulationEngine(60)
+    
+    assert engine.step(600) == 600, "step should return the current tick"
+    assert engine.tick_count == 600, "Engine should have advanced 600 ticks"
+    assert engine.car_counter > 0, "Cars should have spawned"
+    
+    assert engine.run_until(900) == 900, "run_until should stop at the requested tick"
+    assert engine.run_until(100) == 900, "run_until should never go backwards"
+    
+    print(f"✓ Headless engine ran {engine.tick_count} ticks, spawned {engine.car_counter} cars")
+
+def test_pathfinder_paths():
+    """Test the parent-pointer search returns contiguous, optimal paths"""
+    print("\nTesting parent-pointer pathfinding...")
+    lot = ParkingLot()
+    
+    path, parking, cost = lot.find_shortest_path_to_parking(ENTRY_POINTS[1])
+    assert path[0] == ENTRY_POINTS[1], "Path should start at the entry point"
+    for a, b in zip(path, path[1:]):
+        assert abs(a[0] - b[0]) + abs(a[1] - b[1]) == 1, f"Path jumps from {a} to {b}"
+    assert abs(path[-1][0] - parking[0]) + abs(path[-1][1] - parking[1]) == 1, "Parking should be next to the path end"
+    assert cost == sum(lot.road_weights[r][c] for r, c in path[1:]), "Cost should be the sum of entered weights"
+    
+    # Multi-source exit search picks the cheaper of the two starts
+    starts = [(15, 15), (29, 30)]
+    path, exit_point, cost = lot.find_shortest_path_to_exit_from(starts)
+    assert path[0] == (29, 30) and exit_point == (30, 30), "Should start from the start closest to an exit"
+    assert cost == 1.0, "One step to the exit should cost 1.0"
+    
+    # Search state is reset between searches
+    assert lot.find_shortest_path_to_exit((15, 15)) == lot.find_shortest_path_to_exit((15, 15))
+    
+    print("✓ Parent-pointer pathfinding works correctly")
+
+def test_road_graph():
+    """Test the compiled road graph matches the grid"""
+    print("\nTesting compiled road graph...")
+    lot = ParkingLot()
+    graph = lot.graph
+    
+    assert graph.node_count == 31 * 31, "Graph should cover every cell"
+    assert sum(graph.is_road) == 461, "Graph should have 461 road cells"
+    assert sum(graph.is_parking) == 500, "Graph should have 500 parking cells"
+    assert len(graph.offsets) == graph.node_count + 1, "CSR offsets need one entry per cell plus one"
+    
+    # Corner road (0, 0) connects right and down only
+    assert lot.get_neighbors((0, 0)) == [(0, 1), (1, 0)], "Corner should have two road neighbors"
+    # Road (3, 1) sits between parking rows
+    assert lot.get_adjacent_parking((3, 1)) == [(4, 1), (2, 1)], "Road should see parking above and below"
+    # A parking stall reaches its access road
+    assert lot.get_neighbors((2, 2)) == [(3, 2)], "Stall should have one access road"
+    
+    print("✓ Road graph compiled correctly")
+
+def test_exit_field_repair():
+    """Test the cached exit field stays equal to a full rebuild under weight churn"""
+    print("\nTesting incremental exit distance field...")
+    lot = ParkingLot()
+    lot.find_shortest_path_to_exit((15, 15))  # Builds the field
+    
+    route = lot.find_shortest_path_to_exit((0, 30))[0]
+    for step, pos in enumerate(route):
+        lot.increment_segment(pos, 10.5)
+        if step % 3 == 0:
+            lot.decrement_segment(route[step // 2], 12)
+        lot.find_shortest_path_to_exit((0, 30))  # Repairs the field
+        
+        reference = ExitField(lot, EXIT_POINTS)
+        reference.rebuild()
+        for node, (repaired, rebuilt) in enumerate(zip(lot.exit_field.dist, reference.dist)):
+            assert abs(repaired - rebuilt) < 1e-9 or repaired == rebuilt, f"Distance differs at node {node}"
+    
+    assert lot.exit_field.rebuilds == 1, "Small weight changes should be repaired, not rebuilt"
+    path, exit_point, cost = lot.find_shortest_path_to_exit((0, 30))
+    assert abs(cost - sum(lot.road_weights[r][c] for r, c in path[1:])) < 1e-9, "Cost should match the walked path"
+    
+    print(f"✓ Exit field repaired {lot.exit_field.repairs} times without a rebuild")
+
+def test_exit_field_tie_breaks():
+    """Test the exit field picks the same exit and path as a forward search among equal-cost routes"""
+    print("\nTesting exit field tie-breaking...")
+    from benchmark import legacy_path_to_exit
+    
+    engine = SimulationEngine(1, seed=1)
+    engine.step(760)
+    lot = engine.parking_lot
+    # Exits (30, 0) and (30, 15) are both 29.0 away from this stall's access road
+    path, exit_point, cost = lot.find_shortest_path_to_exit_from(lot.get_neighbors((16, 1)))
+    assert (exit_point, cost, len(path)) == ((30, 0), 29.0, 27), "Equal-cost exits should break ties as before"
+    
+    weights = lot.road_weights.tolist()
+    for node in lot.road_nodes.tolist():
+        start = divmod(node, lot.graph.size)
+        route = lot.find_shortest_path_to_exit(start)
+        reference = legacy_path_to_exit(lot, start, weights)
+        ranked = lot.rank_exit_paths(start, limit=1)[0]
+        assert route[:2] == reference[:2] == ranked[:2], f"Exit routes from {start} should agree"
+        assert route[2] == reference[2] == ranked[2], f"Exit costs from {start} should agree"
+    
+    print("✓ Exit field breaks ties like the forward search")
+
+def test_parking_status_index():
+    """Test status sets, counts and per-road empty stall index stay in sync"""
+    print("\nTesting indexed parking status...")
+    lot = ParkingLot()
+    road = (3, 1)
+    stalls = lot.get_adjacent_parking(road)
+    
+    assert lot.status_count('empty') == 500, "All 500 stalls should start empty"
+    assert lot.empty_adjacent[lot.pathfinder.index(road)] == 2, "Road should see two empty stalls"
+    
+    lot.reserve_parking(stalls[0])
+    lot.occupy_parking(stalls[1])
+    assert lot.status_count('empty') == 498, "Two stalls should no longer be empty"
+    assert lot.status_count('reserved') == 1 and lot.status_count('occupied') == 1
+    assert lot.empty_adjacent[lot.pathfinder.index(road)] == 0, "Road should see no empty stalls"
+    
+    lot.occupy_parking(stalls[0])
+    lot.free_parking(stalls[1])
+    assert lot.status_sets['occupied'] == {stalls[0]}, "Occupied set should follow status changes"
+    assert lot.empty_adjacent[lot.pathfinder.index(road)] == 1, "Freed stall should count again"
+    
+    # Recounting from scratch agrees with the incremental index
+    counts = list(lot.empty_adjacent)
+    lot.index_parking_status()
+    assert counts == lot.empty_adjacent, "Incremental counts should match a full rebuild"
+    assert not ParkingLot().find_shortest_path_to_parking((0, 0), exclude_parking=True)[0]
+    
+    print("✓ Parking status index works correctly")
+
+def test_astar_parking_search():
+    """Test A* finds equally cheap parking while expanding fewer nodes"""
+    print("\nTesting A* parking search...")
+    lot = ParkingLot()
+    # Nearly full lot: only a few stalls left in the bottom rows
+    for pos in list(lot.parking_status):
+        if pos[0] < 26 or pos[1] % 7:
+            lot.occupy_parking(pos)
+    
+    for pos in [(0, 0), (15, 15), (9, 30)]:
+        brute = min(abs(pos[0] - r) + abs(pos[1] - c) for r, c in lot.status_sets['empty'])
+        assert lot.nearest_empty_distance(pos) == brute, f"Nearest empty distance wrong at {pos}"
+    
+    start = ENTRY_POINTS[0]
+    dijkstra = lot.find_shortest_path_to_parking(start, search='dijkstra')
+    dijkstra_expanded = lot.pathfinder.nodes_expanded
+    astar = lot.find_shortest_path_to_parking(start, search='astar')
+    astar_expanded = lot.pathfinder.nodes_expanded
+    
+    assert astar[1] is not None and lot.parking_status[astar[1]] == 'empty', "A* should find an empty stall"
+    assert abs(astar[2] - dijkstra[2]) < 1e-9, "A* should find an equally cheap path"
+    assert astar_expanded < dijkstra_expanded, "A* should expand fewer nodes"
+    
+    astar_lot = ParkingLot(parking_search='astar')
+    assert astar_lot.find_shortest_path_to_parking(start)[2] == ParkingLot().find_shortest_path_to_parking(start)[2]
+    
+    print(f"✓ A* expanded {astar_expanded} nodes vs {dijkstra_expanded} for Dijkstra")
+
+def test_array_backed_weights():
+    """Test the NumPy cell and weight arrays and whole-path weight updates"""
+    print("\nTesting array-backed grid and weights...")
+    lot = ParkingLot()
+    
+    assert lot.cells.dtype.name == 'int8', "Cell types should be an int8 array"
+    assert (lot.cells == 1).sum() == 461 and (lot.cells == 2).sum() == 500, "Cell codes should match the grid"
+    assert lot.weights_flat.base is lot.road_weights, "Flat weights should share the 2D array's memory"
+    
+    # Parking cells on a path are skipped, road cells updated together
+    path = [(3, 1), (2, 1), (3, 2)]
+    lot.update_path_weights(path, 4)
+    assert lot.road_weights[3, 1] == 5.0 and lot.road_weights[3, 2] == 5.0, "Road cells should gain 4"
+    assert lot.road_weights[2, 1] == 1.0, "Parking cells should be left alone"
+    
+    # Release clamps at the 1.0 floor
+    lot.release_path_weights(path, 10)
+    assert lot.road_weights[3, 1] == 1.0 and lot.road_weights[3, 2] == 1.0, "Weights should clamp to 1.0"
+    lot.release_path_weights([], 10)  # Empty paths are a no-op
+    
+    # A path that visits a cell twice changes it twice, like the per-cell loop
+    loop = [(3, 1), (3, 2), (3, 1)]
+    lot.update_path_weights(loop, 4)
+    assert lot.road_weights[3, 1] == 9.0 and lot.road_weights[3, 2] == 5.0, "Revisited cells should gain 4 twice"
+    lot.release_path_weights(loop, 3)
+    assert lot.road_weights[3, 1] == 3.0 and lot.road_weights[3, 2] == 2.0, "Revisited cells should lose 3 twice"
+    lot.release_path_weights(loop, 3)
+    assert lot.road_weights[3, 1] == 1.0 and lot.road_weights[3, 2] == 1.0, "Weights should still clamp to 1.0"
+    
+    print("✓ Array-backed weights work correctly")
+
+def test_car_store():
+    """Test that the batched CarStore moves cars exactly like Car.update"""
+    print("\nTesting struct-of-arrays car store...")
+    path = [(0, 0), (0, 1), (0, 2)]
+    
+    plain_lot, store_lot = ParkingLot(), ParkingLot()
+    plain = Car(0, (0, 0), list(path), (1, 2), plain_lot, parking_duration=600)
+    store = CarStore(capacity=1)
+    batched = Car(0, (0, 0), list(path), (1, 2), store_lot, store=store, parking_duration=600)
+    assert batched.visual_position == plain.visual_position, "Store should hold the start position"
+    assert store.moving[batched.slot], "An entering car with a path should be in motion"
+    
+    for _ in range(40):
+        plain.update()
+        if store.moving[batched.slot]:
+            for car in store.advance():
+                car.arrive()
+        else:
+            batched.update()
+        assert batched.visual_position == plain.visual_position, "Batched movement should match per-car"
+        assert batched.position == plain.position and batched.state == plain.state
+    assert batched.state == 'parked' and not store.moving[batched.slot], "Parked cars should stop moving"
+    
+    # Slots are recycled and the arrays grow on demand
+    extra = Car(1, (0, 30), [(0, 30), (0, 29)], (1, 29), store_lot, store=store, parking_duration=600)
+    assert len(store) == 2 and store.capacity == 2, "Store should double when full"
+    store.remove(batched)
+    assert len(store) == 1 and store.free_slots == [batched.slot], "Removed slots should be free for reuse"
+    assert extra.visual_position == [30 * 25 + 12, 12], "Other cars should keep their slot"
+    
+    empty = CarStore(capacity=0)
+    Car(2, (0, 0), list(path), (1, 2), ParkingLot(), store=empty, parking_duration=600)
+    assert len(empty) == 1 and empty.capacity == 1, "An empty store should grow on the first add"
+    
+    print("✓ Car store works correctly")
+
+def test_car_pool():
+    """Test slotted cars, pool recycling and swap-remove of exited cars"""
+    print("\nTesting car pooling...")
+    engine = SimulationEngine(0)
+    lot = engine.parking_lot
+    starts = [(0, 0), (0, 15), (0, 30)]
+    for car_id, start in enumerate(starts):
+        engine.add_car(engine.pool.acquire(car_id, start, [start], (1, start[1]), lot, store=engine.store,
+                                           parking_duration=600))
+    assert not hasattr(engine.cars[0], '__dict__'), "Cars should be slotted"
+    
+    first = engine.cars[0]
+    engine.remove_car(first)
+    assert [car.id for car in engine.cars] == [2, 1], "Last car should fill the removed car's place"
+    assert [car.index for car in engine.cars] == [0, 1], "Indexes should follow the swap"
+    assert sorted(engine.cars_by_id) == [1, 2] and engine.cars_by_id[2] is engine.cars[0], \
+        "Registry should drop removed cars"
+    assert engine.pool.free == [first] and first.path is None, "Removed cars should be cleared and pooled"
+    
+    recycled = engine.pool.acquire(3, (0, 0), [(0, 0)], (1, 0), lot, store=engine.store, parking_duration=600)
+    assert recycled is first and recycled.id == 3 and recycled.state == 'entering', "Pool should reuse cars"
+    assert engine.pool.created == 3 and engine.pool.reused == 1
+    
+    pool = CarPool(max_size=0)
+    pool.release(recycled)
+    assert pool.free == [], "A full pool should drop released cars"
+    
+    print("✓ Car pool works correctly")
+
+def test_wait_for_graph():
+    """Test incremental deadlock detection through the wait-for graph"""
+    print("\nTesting wait-for graph deadlock detection...")
+    engine = SimulationEngine(0)
+    lot = engine.parking_lot
+    
+    def wait(car_id, cell, target):
+        car = Car(car_id, cell, [cell, target], target, lot, wait_graph=engine.wait_graph, parking_duration=600)
+        engine.add_car(car)
+        car.state = 'waiting'
+        return car
+    
+    # Two disjoint head-on pairs plus a car queued behind the first pair
+    wait(0, (0, 1), (0, 2))
+    wait(1, (0, 2), (0, 1))
+    wait(2, (0, 0), (0, 1))
+    wait(3, (0, 20), (0, 21))
+    wait(4, (0, 21), (0, 20))
+    assert engine.cars_by_id[1] is engine.cars[1], "Registry should map ids to cars"
+    
+    cycles = engine.detect_deadlock()
+    assert sorted(sorted(car.id for car in cycle) for cycle in cycles) == [[0, 1], [3, 4]], \
+        "All disjoint cycles should be reported, without the queued car"
+    assert engine.detect_deadlock() == [], "Known cycles should not be reported again"
+    
+    # Breaking a cycle and closing it again reports it anew
+    graph = engine.wait_graph
+    old_cycle = graph.cycle_of[0]
+    assert graph.is_deadlocked(old_cycle)
+    car0 = engine.cars_by_id[0]
+    car0.state = 'entering'
+    assert engine.detect_deadlock() == [], "A broken cycle is not a deadlock"
+    car0.state = 'waiting'
+    assert [sorted(car.id for car in cycle) for cycle in engine.detect_deadlock()] == [[0, 1]]
+    # The same cars in the same order form a new cycle; the old report must not count for it
+    assert graph.cycle_of[0] == old_cycle and graph.is_deadlocked(graph.cycle_of[0])
+    assert not graph.is_deadlocked(old_cycle), "A re-formed cycle should not revive the old report"
+    
+    # A long queue with no cycle is not a deadlock (and must not overflow the stack)
+    engine = SimulationEngine(0)
+    lot = engine.parking_lot
+    for car_id in range(1500):
+        cell = (car_id // 30, car_id % 30)
+        car = Car(car_id, cell, [], (0, 0), lot, wait_graph=engine.wait_graph, parking_duration=600)
+        lot.road_occupancy[cell] = car_id  # Only the occupancy map matters to detection
+        car.target_segment = ((car_id + 1) // 30, (car_id + 1) % 30)
+        car.state = 'waiting'
+        engine.add_car(car)
+    assert engine.detect_deadlock() == [], "A queue should not be reported as a deadlock"
+    
+    print("✓ Wait-for graph works correctly")
+
+def test_event_scheduler():
+    """Test that parked and waiting cars sleep until their events are due"""
+    print("\nTesting event scheduling of idle cars...")
+    engine = SimulationEngine(0)
+    lot = engine.parking_lot
+    
+    # Park a car on (1, 1) from (0, 1); it should only wake on its departure tick
+    parked = Car(0, (0, 1), [(0, 1)], (1, 1), lot, store=engine.store, wait_graph=engine.wait_graph,
+                 parking_duration=50)
+    engine.add_car(parked)
+    engine.step(2)
+    assert parked.state == 'parked', "Car should have parked"
+    assert engine.scheduler.departures == [(50, 0)], "Departure should be scheduled"
+    engine.run_until(50)
+    assert parked.state == 'parked' and parked.parked_timer == 0, "Parked cars should not be polled"
+    engine.step(1)
+    assert parked.state == 'exiting', "Car should leave on its departure tick"
+    
+    # A waiting car sleeps until its target segment is freed
+    blocker = (0, 10)
+    lot.occupy_road(blocker, 99)
+    waiter = Car(1, (0, 8), [(0, 8), (0, 9), blocker], (1, 10), lot,
+                 store=engine.store, wait_graph=engine.wait_graph, parking_duration=600)
+    engine.add_car(waiter)
+    for _ in range(40):
+        engine.step(1)
+        if waiter.state == 'waiting':
+            break
+    assert waiter.state == 'waiting' and engine.wait_graph.waiters[blocker] == {1}
+    engine.step(30)
+    assert waiter.state == 'waiting' and waiter.waiting_timer == 0, "Waiting cars should not be polled"
+    lot.free_road(blocker)
+    assert engine.scheduler.wakes == {1}, "Freeing the segment should wake its waiter"
+    engine.step(1)
+    assert waiter.state == 'entering' and blocker not in engine.wait_graph.waiters
+    
+    print("✓ Event scheduler works correctly")
+
+def test_stats_counters():
+    """Test that the running car counters match a full recount"""
+    print("\nTesting incremental statistics...")
+    import random
+    random.seed(11)
+    engine = SimulationEngine(60)
+    for _ in range(20):
+        engine.step(150)
+        cars = engine.cars
+        stats = engine.stats()
+        assert stats['entering'] == len([c for c in cars if c.state in ['entering', 'waiting'] and not c.is_exiting])
+        assert stats['exiting'] == len([c for c in cars if c.state in ['exiting', 'waiting'] and c.is_exiting])
+        assert stats['parked'] == len([c for c in cars if c.state == 'parked'])
+        assert stats['waiting'] == len([c for c in cars if c.state == 'waiting'])
+    assert stats['exited'] == engine.car_counter - len(engine.cars), "Exited count should cover removed cars"
+    assert stats['tick'] == 3000 and stats['total_spawned'] == engine.car_counter
+    assert stats['empty_spaces'] == list(engine.parking_lot.parking_status.values()).count('empty')
+    
+    print("✓ Statistics counters work correctly")
+
+def test_glyph_cache():
+    """Test the LRU glyph cache used for weight labels"""
+    print("\nTesting glyph cache...")
+    rendered = []
+    cache = GlyphCache(lambda text: rendered.append(text) or text.upper(), max_size=2)
+    
+    assert cache.get("1.0") == "1.0".upper() and cache.get("1.0") == "1.0"
+    cache.get("2.5")
+    cache.get("1.0")  # Now most recently used
+    cache.get("4.0")  # Evicts 2.5
+    assert list(cache.surfaces) == ["1.0", "4.0"], "Least recently used label should be evicted"
+    cache.get("2.5")
+    assert rendered == ["1.0", "2.5", "4.0", "2.5"], "Only misses should render"
+    assert cache.stats() == {'hits': 2, 'misses': 4, 'size': 2, 'hit_rate': 2 / 6}
+    
+    print("✓ Glyph cache works correctly")
+
+def test_dirty_rendering():
+    """Test that only changed tiles are redrawn (uses SDL's dummy video driver)"""
+    print("\nTesting cached dirty-rect rendering...")
+    import parking_lot_simulation
+    if parking_lot_simulation.pygame is None:
+        print("✓ Skipped (pygame is not installed)")
+        return
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    sim = parking_lot_simulation.Simulation(0)
+    
+    assert len(sim.update_tiles()) == 31 * 31, "First update should draw every tile"
+    assert sim.update_tiles() == [], "Nothing changed, nothing to redraw"
+    
+    sim.parking_lot.reserve_parking((1, 1))
+    sim.parking_lot.increment_segment((0, 5), 0.04)  # Label still reads 1.0
+    sim.parking_lot.increment_segment((0, 6), 2)
+    rects = sim.update_tiles()
+    assert [(r.x, r.y) for r in rects] == [(6 * 25, 0), (25, 25)], "Only the changed tiles should be redrawn"
+    assert tuple(sim.lot_surface.get_at((37, 37)))[:3] == (255, 255, 0), "Reserved stall should be yellow"
+    
+    sim.draw()
+    sim.draw()
+    assert not sim.full_redraw and sim.stats_lines is not None
+    
+    # Every road label so far read 1.0 or 3.0: two glyphs rendered, the rest cache hits
+    cache = sim.label_cache.stats()
+    assert cache['misses'] == 2 and cache['hits'] == 461 - 2 + 1, "Labels should come from the glyph cache"
+    
+    # Quantized labels skip redraws for small changes; hidden labels skip them entirely
+    quantized = parking_lot_simulation.Simulation(0, label_step=1.0)
+    quantized.update_tiles()
+    quantized.parking_lot.increment_segment((0, 5), 0.4)
+    assert quantized.update_tiles() == [], "A change below the label step should not redraw"
+    hidden = parking_lot_simulation.Simulation(0, label_min_cell_size=100)
+    hidden.update_tiles()
+    hidden.parking_lot.increment_segment((0, 5), 5)
+    assert hidden.update_tiles() == [] and hidden.label_cache.stats()['size'] == 0
+    parking_lot_simulation.pygame.quit()
+    
+    print("✓ Dirty-rect rendering works correctly")
+
+def test_lot_layout():
+    """Test parameterized lot layouts"""
+    print("\nTesting lot layouts...")
+    default = LotLayout()
+    assert default.entry_points == ENTRY_POINTS and default.exit_points == EXIT_POINTS
+    assert ParkingLot(default).grid == ParkingLot().grid, "Default layout should be the original lot"
+    assert default.cell_size == 25 and default.window_size == (775, 875)
+    
+    # A wide lot with 1 stall row per road row and 3 stalls per block
+    layout = LotLayout(rows=9, cols=20, stall_rows=1, road_rows=1, stall_cols=3, road_cols=1)
+    lot = ParkingLot(layout)
+    assert len(lot.grid) == 9 and len(lot.grid[0]) == 20 and lot.road_weights.shape == (9, 20)
+    assert [lot.grid[1][col] for col in range(1, 6)] == ['parking'] * 3 + ['road', 'parking']
+    assert all(cell == 'road' for cell in lot.grid[2]), "Every second inner row should be road"
+    assert layout.exit_points == [(8, 0), (8, 10), (8, 19)]
+    path, exit_point, _ = lot.find_shortest_path_to_exit((0, 19))
+    assert exit_point == (8, 19) and path[-1] == exit_point
+    path, spot, _ = lot.find_shortest_path_to_parking((4, 0))
+    assert spot in lot.parking_status and path[0] == (4, 0)
+    
+    # Large lots get a smaller default cell size; gates must be road cells
+    assert LotLayout(301).cell_size == 2
+    try:
+        LotLayout(entry_points=[(1, 1)])
+        assert False, "A gate on a stall should be rejected"
+    except ValueError:
+        pass
+    
+    engine = SimulationEngine(60, layout)
+    engine.step(600)
+    assert engine.layout is layout and engine.car_counter > 0, "Engine should spawn on the custom layout"
+    assert all(car.position[0] < 9 and car.position[1] < 20 for car in engine.cars)
+    
+    print("✓ Lot layouts work correctly")
+
+def test_profiler():
+    """Test opt-in per-phase profiling"""
+    print("\nTesting profiler...")
+    import json
+    import tempfile
+    engine = SimulationEngine(60)
+    assert engine.profiler is None, "Profiling should be off by default"
+    profiler = engine.enable_profiling(window=50)
+    engine.step(100)
+    
+    summary = profiler.summary()
+    assert summary['frames'] == 100, "Each headless tick is one frame"
+    assert set(summary['phases']) >= {'spawn', 'update_cars', 'detect_deadlock', 'resolve_deadlock'}
+    assert summary['phases']['update_cars']['calls'] == 100
+    assert len(profiler.timings['spawn']) == 50, "Only the last window of frames is kept"
+    assert summary['counters']['searches'] > 0 and summary['counters']['nodes_expanded'] > 0
+    assert summary['counters']['cars'] > 0, "Car count is sampled as a level"
+    counts, edges = profiler.histogram('update_cars', bins=5)
+    assert sum(counts) == 50 and len(edges) == 6
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'profile.json')
+        profiler.dump(path)
+        with open(path) as f:
+            report = json.load(f)
+    assert sum(report['phases']['spawn']['histogram']['counts']) == 50
+    
+    import parking_lot_simulation
+    if parking_lot_simulation.pygame is not None:
+        os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+        sim = parking_lot_simulation.Simulation(60, profile=True)
+        sim.tick()
+        sim.tick()
+        sim.draw()
+        assert sim.car_rects[-1].topleft == (0, 0), "Overlay should be drawn and erased next frame"
+        assert sim.profiler.frames == 0, "Ticks in the window don't close frames themselves"
+        
+        # One pass of the main loop is one frame, events through the clock wait
+        pygame = parking_lot_simulation.pygame
+        sim.profiler.frame_times.clear()
+        pygame.event.post(pygame.event.Event(pygame.QUIT))
+        sim.run()
+        frame = {phase: history[-1] for phase, history in sim.profiler.timings.items()}
+        assert sim.profiler.frames == 1
+        assert frame['events'] > 0 and frame['spawn'] > 0 and frame['draw'] > 0 and frame['clock_wait'] > 0
+    
+    print("✓ Profiler works correctly")
+
+def test_record_replay():
+    """Test seeded runs and arrival log record/replay"""
+    print("\nTesting seeded record/replay...")
+    import tempfile
+    from parking_lot_simulation import ArrivalLog
+    first = SimulationEngine(120, seed=7, record=True)
+    second = SimulationEngine(120, seed=7)
+    first.step(2000)
+    second.step(2000)
+    assert first.digest() == second.digest(), "Same seed should give the same outcome"
+    other = SimulationEngine(120, seed=8)
+    other.step(2000)
+    assert other.digest() != first.digest(), "Another seed should give another run"
+    
+    log = first.arrival_log
+    assert len(log) > 0 and log.arrivals[0][0] == 0, "Every arrival should be logged with its tick"
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'arrivals.json')
+        log.save(path)
+        loaded = ArrivalLog.load(path)
+    assert loaded.arrivals == log.arrivals, "Log should survive a save/load round trip"
+    
+    # Replay ignores the spawn rate and the seed: the log alone decides arrivals
+    replayed = SimulationEngine(0, seed=99, replay=loaded)
+    replayed.step(2000)
+    assert replayed.digest() == first.digest(), "Replay should reproduce the recorded run exactly"
+    
+    # Cars never fall back to the global random module, not even the
+    # benchmark's hand-placed ones
+    import random
+    from benchmark_suite import populate
+    digests = []
+    for global_seed in (1, 2):
+        random.seed(global_seed)
+        engine = SimulationEngine(60, seed=3)
+        populate(engine, 50, random.Random(3))
+        engine.step(1200)
+        digests.append(engine.digest())
+    assert digests[0] == digests[1], "A seeded engine should not depend on the global RNG"
+    try:
+        Car(0, (0, 0), [(0, 0)], (1, 0), ParkingLot())
+        assert False, "A car without a parking duration should be rejected"
+    except TypeError:
+        pass
+    
+    print("✓ Seeded record/replay works correctly")
+
+def test_run_metrics():
+    """Test run metrics and the parameter sweep aggregation"""
+    print("\nTesting run metrics and sweep...")
+    import sweep
+    engine = SimulationEngine(60, seed=3)
+    engine.step(3600)
+    metrics = engine.metrics()
+    assert metrics['exited'] == engine.stats()['exited'] and metrics['exits_per_60_ticks'] == metrics['exited'] / 60
+    assert metrics['mean_time_to_park_s'] > 0 and metrics['mean_wait_s'] >= 0
+    ticks = engine.counters.car_ticks
+    assert sum(ticks[key] for key in ticks if key != 'exited') >= len(engine.cars), "Every car adds a car-tick"
+    
+    # Throughput shares the arrival rate's unit, so at steady state it cannot exceed it
+    engine = SimulationEngine(10, seed=2)
+    engine.step(3600)
+    exited = engine.metrics()['exited']
+    engine.step(3600)
+    steady = (engine.metrics()['exited'] - exited) / 60
+    assert 0 < steady <= 10 and engine.metrics()['exits_per_60_ticks'] <= 10, \
+        "Exits per 60 ticks should stay at or below the arrival rate"
+    
+    # Above one car per tick every arrival that falls due is offered, so a sweep's rate is the real one
+    engine = SimulationEngine(120, seed=3)
+    engine.step(600)
+    assert engine.car_counter + engine.spawn_rejects == 1200, "Every arrival should be spawned or rejected"
+    
+    assert sweep.parse_layout('31') == (31, 31) and sweep.parse_layout('21x41') == (21, 41)
+    results = sweep.sweep([10, 60], [(21, 21)], [1, 2], minutes=0.25, workers=1)
+    assert len(results) == 4 and (results[0]['rate'], results[0]['seed']) == (10, 1)
+    rerun = sweep.run_one((10, (21, 21), 1, 0.25))
+    assert rerun['exits_per_60_ticks'] == results[0]['exits_per_60_ticks'], "A seeded run should repeat exactly"
+    rows = sweep.aggregate(results)
+    assert [(row['rate'], row['layout'], row['runs']) for row in rows] == [(10, '21x21', 2), (60, '21x21', 2)]
+    
+    print("✓ Run metrics and sweep work correctly")
+
+def test_route_cache():
+    """Test the route cache, exact by default and with a tolerance"""
+    print("\nTesting route cache...")
+    lot = ParkingLot()
+    cache = lot.enable_route_cache(max_size=2, tolerance=0.0)
+    first = lot.find_shortest_path_to_exit((0, 10))
+    assert lot.find_shortest_path_to_exit((0, 10))[0] is first[0], "An unchanged lot should serve the cached route"
+    lot.increment_segment((0, 5), 0.5)
+    assert lot.find_shortest_path_to_exit((0, 10))[0] is not first[0], "Tolerance 0 recomputes after any update"
+    lot.find_shortest_path_to_exit((0, 20))
+    lot.find_shortest_path_to_exit((10, 0))
+    assert cache.stats()['evictions'] == 1 and cache.stats()['size'] == 2, "Least recently used should go"
+    
+    # With a tolerance, a route is re-priced and served while it got at most that much dearer
+    cache.tolerance = 0.5
+    path, exit_point, cost = lot.find_shortest_path_to_exit((0, 20))
+    lot.increment_segment(path[1], 2)
+    served = lot.find_shortest_path_to_exit((0, 20))
+    assert served[0] is path and served[2] == cost + 2, "Served route should carry its current cost"
+    lot.increment_segment(path[1], cost)
+    assert lot.find_shortest_path_to_exit((0, 20))[0] is not path, "Too much dearer: search again"
+    assert cache.stats()['stale'] == 2 and cache.stats()['mean_cost_rise'] > 0
+    
+    # Parking routes move on to the next empty stall at the same road cell
+    path, spot, cost = lot.find_shortest_path_to_parking((3, 2))  # Aisle with stalls on both sides
+    lot.reserve_parking(spot)
+    again = lot.find_shortest_path_to_parking((3, 2))
+    assert again[0] is path and again[1] != spot and lot.parking_status[again[1]] == 'empty'
+    
+    # ... but are dropped at any tolerance once a stall is freed, since it might be closer
+    lot.free_parking(spot)
+    assert lot.find_shortest_path_to_parking((3, 2))[0] is not path, "A freed stall should drop parking routes"
+    
+    # Audits compare served routes with a fresh search
+    audited = ParkingLot().enable_route_cache(tolerance=0.5, audit_every=1)
+    route = audited.parking_lot.find_shortest_path_to_exit((0, 20))
+    audited.parking_lot.find_shortest_path_to_exit((0, 20))
+    assert audited.stats()['audited'] == 1 and audited.stats()['mean_excess_cost'] == 0.0
+    audited.parking_lot.increment_segment(route[0][10], 10)  # Another route is now cheaper
+    served = audited.parking_lot.find_shortest_path_to_exit((0, 20))
+    assert served[0] is route[0] and audited.stats()['worse_rate'] == 0.5, "A dearer route should count as worse"
+    assert audited.stats()['mean_excess_cost'] > 0
+    
+    # The default is exact: caching must not change a run at all
+    plain = SimulationEngine(60, seed=4)
+    cached = SimulationEngine(60, seed=4)
+    assert cached.parking_lot.enable_route_cache().tolerance == 0.0
+    plain.step(3000)
+    cached.step(3000)
+    assert plain.digest() == cached.digest(), "Tolerance 0 should be exact"
+    assert cached.parking_lot.route_cache.stats()['misses'] > 0, "Every search should go through the cache"
+    
+    print("✓ Route cache works correctly")
+
+def test_ranked_exits():
+    """Test ranking every exit in one search and rerouting to another gate"""
+    print("\nTesting ranked exit paths...")
+    lot = ParkingLot()
+    searches = lot.pathfinder.search_count
+    ranked = lot.rank_exit_paths((0, 10))
+    assert lot.pathfinder.search_count == searches + 1, "All exits should come from one search"
+    assert sorted(exit_point for _, exit_point, _ in ranked) == sorted(EXIT_POINTS)
+    costs = [cost for _, _, cost in ranked]
+    assert costs == sorted(costs) and costs[0] == lot.find_shortest_path_to_exit((0, 10))[2]
+    assert all(path[0] == (0, 10) and path[-1] == exit_point for path, exit_point, _ in ranked)
+    
+    nearest = ranked[0][1]
+    assert lot.rank_exit_paths((0, 10), exclude=[nearest], limit=1) == [ranked[1]], \
+        "Excluding the nearest exit should give the runner-up"
+    
+    # A deadlocked exiting car heading for the nearest exit is sent to another one
+    engine = SimulationEngine(0)
+    path, exit_point, _ = engine.parking_lot.find_shortest_path_to_exit((21, 10))
+    car = Car(0, (21, 10), path, exit_point, engine.parking_lot, is_exiting=True, parking_duration=600)
+    engine.add_car(car)
+    engine.resolve_deadlock([car])
+    assert car.destination != exit_point and car.destination in EXIT_POINTS and car.in_deadlock
+    assert car.path[0] == (21, 10) and car.path[-1] == car.destination
+    assert engine.total_deadlocks_resolved == 1
+    
+    print("✓ Ranked exit paths work correctly")
+
+def test_checkpoint():
+    """Test saving and restoring the complete simulation state"""
+    print("\nTesting checkpoint and warm start...")
+    import tempfile
+    engine = SimulationEngine(120, LotLayout(25, 37), seed=5, record=True)
+    engine.step(1500)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'warm.npz')
+        engine.save_checkpoint(path)
+        restored = SimulationEngine.load_checkpoint(path)
+        forked = SimulationEngine.load_checkpoint(path, seed=6)
+    
+    assert restored.digest() == engine.digest(), "Restored state should match the saved one"
+    assert restored.layout.rows == 25 and restored.layout.cols == 37 and restored.tick_count == 1500
+    assert restored.arrival_log.arrivals == engine.arrival_log.arrivals
+    engine.step(1500)
+    restored.step(1500)
+    forked.step(1500)
+    assert restored.digest() == engine.digest(), "A restored run should continue exactly like the original"
+    assert restored.stats() == engine.stats() and restored.metrics() == engine.metrics()
+    assert forked.digest() != engine.digest(), "A reseeded fork should diverge"
+    
+    # The restored statuses go into the constructor, so the indexes are built once
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'warm.npz')
+        engine.save_checkpoint(path)
+        builds = []
+        original = ParkingLot.index_parking_status
+        ParkingLot.index_parking_status = lambda lot: builds.append(lot) or original(lot)
+        try:
+            restored = SimulationEngine.load_checkpoint(path)
+        finally:
+            ParkingLot.index_parking_status = original
+    lot = restored.parking_lot
+    assert len(builds) == 1, "Restoring should index the parking statuses once"
+    assert (lot.status_grid == engine.parking_lot.status_grid).all()
+    assert lot.status_sets == engine.parking_lot.status_sets
+    assert lot.empty_adjacent == engine.parking_lot.empty_adjacent
+    assert lot.empty_by_row == engine.parking_lot.empty_by_row and lot.empty_rows == engine.parking_lot.empty_rows
+    
+    print("✓ Checkpoint and warm start work correctly")
+
+def test_telemetry():
+    """Test streaming telemetry records to NDJSON and CSV sinks"""
+    print("\nTesting telemetry export...")
+    import io
+    import itertools
+    import json
+    from parking_lot_simulation import NDJSONSink, CSVSink
+    engine = SimulationEngine(120, seed=2, record=True)
+    out = io.StringIO()
+    sink = NDJSONSink(out, buffer_size=4)
+    assert sink.write_all(engine.telemetry(n_ticks=600, interval=60)) == 10
+    assert len(out.getvalue().splitlines()) == 8, "Only full buffers should be written before a flush"
+    sink.close()
+    records = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert [record['tick'] for record in records] == list(range(60, 601, 60))
+    last = records[-1]
+    assert last == engine.telemetry_record() and last['max_road_weight'] >= last['mean_road_weight'] >= 1.0
+    assert last['total_spawned'] + last['spawn_rejects'] == len(engine.arrival_log), \
+        "Every arrival is either spawned or rejected"
+    
+    # An open-ended stream: pull as many records as wanted, CSV this time
+    out = io.StringIO()
+    with CSVSink(out) as sink:
+        for record in itertools.islice(engine.telemetry(interval=30), 5):
+            sink.write(record)
+    lines = out.getvalue().splitlines()
+    assert lines[0].split(',') == list(last) and len(lines) == 6
+    assert lines[-1].split(',')[0] == '750' and engine.tick_count == 750
+    
+    print("✓ Telemetry export works correctly")
+
+def test_benchmark_gate():
+    """Test that the benchmark gate passes an identical rerun and flags a real slowdown"""
+    print("\nTesting benchmark regression gate...")
+    import copy
+    import benchmark_suite
+    suite = {'grid_sizes': (31,), 'fills': (0.5,), 'car_counts': (100,), 'repeat': 7}
+    first = benchmark_suite.run_suite(**suite)
+    iterations = {name: result['iterations'] for name, result in first.items()}
+    rerun = benchmark_suite.run_suite(iterations=iterations, **suite)
+    assert benchmark_suite.compare(rerun, {'results': first}, 0.5) == [], "An identical rerun should not regress"
+    
+    # Twice as slow in every batch is flagged, for that case only
+    slower = copy.deepcopy(first)
+    case = slower['parking_search/grid=31/fill=0.5']
+    case['batches_ms'] = [ms * 2 for ms in case['batches_ms']]
+    regressions = benchmark_suite.compare(slower, {'results': first}, 0.5)
+    assert [name for name, _, _, _ in regressions] == ['parking_search/grid=31/fill=0.5']
+    assert abs(regressions[0][3] - 2) < 1e-9
+    
+    # A slowdown within the baseline's own batch spread is noise
+    noisy = {'batches_ms': [1.0, 1.0, 1.0, 1.1, 3.0], 'reference_ms': [1.0] * 5}
+    moved = {'batches_ms': [1.6] * 5, 'reference_ms': [1.0] * 5}
+    assert benchmark_suite.compare({'case': moved}, {'results': {'case': dict(noisy, ms=1.0)}}, 0.5) == []
+    
+    print("✓ Benchmark regression gate works correctly")
+
 def main():
     """Run all tests"""
     print("=" * 60)
@@ -165,6 +938,30 @@ def main():
         test_weight_management()
         test_parking_operations()
         test_car_initialization()
+        test_headless_engine()
+        test_pathfinder_paths()
+        test_road_graph()
+        test_exit_field_repair()
+        test_exit_field_tie_breaks()
+        test_parking_status_index()
+        test_astar_parking_search()
+        test_array_backed_weights()
+        test_car_store()
+        test_car_pool()
+        test_wait_for_graph()
+        test_event_scheduler()
+        test_stats_counters()
+        test_glyph_cache()
+        test_dirty_rendering()
+        test_lot_layout()
+        test_profiler()
+        test_record_replay()
+        test_run_metrics()
+        test_route_cache()
+        test_ranked_exits()
+        test_checkpoint()
+        test_telemetry()
+        test_benchmark_gate()
         
         print("\n" + "=" * 60)
         print("✓ ALL TESTS PASSED!")